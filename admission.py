@@ -0,0 +1,177 @@
+"""受付制御 — 重い処理（整形・PDF変換）の同時実行数と待ち行列の上限を管理する
+
+LibreOffice は1変換あたり数百MBを使うため、同時実行数を ADMISSION_MAX_ACTIVE、
+待ち行列を ADMISSION_MAX_QUEUE に制限し、超えた要求は即座に 429 で断る。
+空きメモリが ADMISSION_MIN_FREE_MB を下回っている場合も 503 で断る。
+断る際は、これまでの処理時間から待ち時間（Retry-After）と順番の目安を返す。
+
+同時実行数・待ち行列はプロセス（gunicorn ワーカー）ごとに数えるため、サーバー全体の上限は
+ワーカー数倍になる。ADMISSION_MAX_ACTIVE × ワーカー数 の変換がメモリに収まるよう設定する。
+空きメモリはコンテナ全体の値で、ワーカー間で共有される。
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+
+ADMISSION_MAX_ACTIVE = int(os.environ.get('ADMISSION_MAX_ACTIVE', '2'))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '10'))
+ADMISSION_MIN_FREE_MB = int(os.environ.get('ADMISSION_MIN_FREE_MB', '300'))
+# 処理時間の実績が無いうちに使う1件あたりの見込み秒数
+ADMISSION_DEFAULT_SECONDS = float(os.environ.get('ADMISSION_DEFAULT_SECONDS', '30'))
+
+
+class Rejected(Exception):
+    """受付不可。status は 429（混雑）または 503（メモリ不足）。"""
+
+    def __init__(self, status, message, retry_after, queue_position):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.queue_position = queue_position
+
+    def to_dict(self):
+        return {'error': str(self), 'retry_after': self.retry_after,
+                'queue_position': self.queue_position}
+
+
+class AdmissionController:
+    """実行中・待機中の重い処理を数え、受付可否を判定する。
+
+    同期処理（/process）は空きがあり、かつ待ち行列が空のときだけ受け付ける。
+    ジョブ（/jobs・/batch）は待ち行列に入れ、start_next() で実行枠が空いた順に先頭から取り出す。
+    """
+
+    def __init__(self, max_active=ADMISSION_MAX_ACTIVE, max_queue=ADMISSION_MAX_QUEUE,
+                 min_free_mb=ADMISSION_MIN_FREE_MB):
+        self.max_active = max(1, max_active)
+        self.max_queue = max_queue
+        self.min_free_mb = min_free_mb
+        self.active = 0
+        self._queue = deque()
+        self._avg_seconds = ADMISSION_DEFAULT_SECONDS
+        self._cond = threading.Condition()
+
+    # --- 受付 ---
+
+    def admit_now(self):
+        """同期処理の実行枠を取る。取れなければ Rejected。戻り値は finish() に渡す開始時刻。"""
+        with self._cond:
+            self._check_memory()
+            if self.active >= self.max_active or self._queue:
+                raise self._busy(len(self._queue) + 1)
+            self.active += 1
+        return time.monotonic()
+
+    def enqueue(self, ticket):
+        """ジョブを待ち行列に入れる。満杯なら Rejected。"""
+        with self._cond:
+            self._check_memory()
+            if len(self._queue) >= self.max_queue:
+                raise self._busy(len(self._queue) + 1)
+            self._queue.append(ticket)
+
+    def start_next(self):
+        """実行枠が空くまで待ち、待ち行列の先頭のジョブを取り出す。
+
+        戻り値は (ticket, finish() に渡す開始時刻)。enqueue() 1回につき1回呼ぶ。
+        呼び出し側はどのジョブを実行するかを選ばず、先頭から順に実行する（受付順を保つ）。
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue and self.active < self.max_active)
+            ticket = self._queue.popleft()
+            self.active += 1
+            self._cond.notify_all()
+        return ticket, time.monotonic()
+
+    def cancel(self, ticket):
+        """実行前のジョブを待ち行列から外す（受付後に実行を依頼できなかった場合）。"""
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def finish(self, started):
+        """実行枠を返し、処理時間の移動平均を更新する。"""
+        with self._cond:
+            self.active -= 1
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - started)
+            self._cond.notify_all()
+
+    # --- 状態 ---
+
+    def position(self, ticket):
+        """待ち行列での順番（1始まり）。待機中でなければ None。"""
+        with self._cond:
+            try:
+                return self._queue.index(ticket) + 1
+            except ValueError:
+                return None
+
+    def estimate_wait(self, position):
+        """position 番目の処理が始まるまでの見込み秒数。"""
+        return math.ceil(math.ceil(position / self.max_active) * self._avg_seconds)
+
+    def snapshot(self):
+        with self._cond:
+            return {'active': self.active, 'queued': len(self._queue),
+                    'max_active': self.max_active, 'max_queue': self.max_queue,
+                    'avg_seconds': round(self._avg_seconds, 1),
+                    'available_mb': available_memory_mb()}
+
+    def _busy(self, position):
+        return Rejected(429, 'サーバーが混雑しています。しばらく待ってから再試行してください。',
+                        self.estimate_wait(position), position)
+
+    def _check_memory(self):
+        free = available_memory_mb()
+        if free is not None and free < self.min_free_mb:
+            position = len(self._queue) + 1
+            raise Rejected(503, 'サーバーのメモリが不足しています。しばらく待ってから再試行してください。',
+                           max(1, self.estimate_wait(position)), position)
+
+
+def available_memory_mb():
+    """利用可能なメモリ（MB）。コンテナ（cgroup v2）の上限があればそちらを優先する。取れなければ None。
+
+    memory.current には回収可能なページキャッシュ（PDFキャッシュ・セッションストア・一時ファイルの読み書き）
+    も含まれるため、非アクティブなファイルキャッシュ（memory.stat の inactive_file）は空きとみなす。
+    """
+    limit = _read_int('/sys/fs/cgroup/memory.max')
+    if limit is not None:
+        usage = _read_int('/sys/fs/cgroup/memory.current')
+        if usage is not None:
+            reclaimable = _read_stat('/sys/fs/cgroup/memory.stat', 'inactive_file') or 0
+            return (limit - max(0, usage - reclaimable)) // (1024 * 1024)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def _read_stat(path, key):
+    """「キー 値」形式のファイル（memory.stat など）から key の値を読む。無ければ None。"""
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(' ')
+                if name == key and value.strip().isdigit():
+                    return int(value)
+    except OSError:
+        pass
+    return None
+
+
+def _read_int(path):
+    """数値の書かれたファイルを読む。'max'（上限なし）や読めない場合は None。"""
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
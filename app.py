@@ -1,66 +1,271 @@
 import os
-import io
-import zipfile
 import tempfile
+import unicodedata
 import shutil
 import traceback
 import logging
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_file
-import uuid
+from flask import Flask, Response, render_template, request, jsonify, send_file
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-from processors.common import clean_formatting, extract_entity_info, cross_check_entities
-from processors.contract import process_contract
-from processors.estimate import process_estimate
-from processors.oath import process_oath
-from processors.checklist import process_checklist
-from processors.confirmation import process_confirmation
-from processors.pdf_converter import convert_to_pdf
+import warmup
+from admission import AdmissionController, Rejected
+from processors.catalog import FILE_TYPES, list_appendix2_files
+from processors.pdf_converter import PDF_PROFILES, PDF_PROFILE, pool_status
+from processors.metrics import (timed, observe, render as render_metrics, server_timing,
+                                mark_startup, startup_times)
+from jobs import JobManager, package_task, batch_task
+
+# 書類処理・一括処理・チェックのモジュール（python-docx・openpyxl・pypdf）は重いので
+# 各ルート内で import し、起動時は warmup がバックグラウンドで先読みする
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
 
 APPENDIX2_DIR = os.path.join(os.path.dirname(__file__), 'assets', 'appendix2')
+# 出力形式: zip（成果物とバックアップのZIP）/ pdf（書類一式を結合した1つのPDF）
+OUTPUT_MODES = ('zip', 'pdf')
+
+admission = AdmissionController()
+job_manager = JobManager(admission=admission)
+warmup.start()
 
-FILE_TYPES = {
-    'contract': {'label': '① 契約書', 'naming': '基本契約書_{company}'},
-    'estimate': {'label': '② 見積書', 'naming': '別紙１_{company}'},
-    'oath': {'label': '③ 誓約書', 'naming': '誓約書_{company}'},
-    'checklist': {'label': '④ チェックシート', 'naming': '持続可能性の確保に向けた取組状況について（チェックシート）_{company}'},
-    'confirmation': {'label': '⑤ 確認書', 'naming': '電子契約サービス利用確認書_{company}'},
-}
+
+@app.after_request
+def record_first_response(response):
+    mark_startup('first_response')
+    return response
 
 
 @app.route('/health')
 def health():
     """Health check endpoint for wake-up and monitoring."""
-    return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
+    return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat(),
+                    'load': admission.snapshot(),
+                    'office_pool': pool_status(),
+                    'startup': dict(startup_times(), modules_ready=warmup.modules_ready())})
+
+
+@app.errorhandler(Rejected)
+def rejected(e):
+    """受付制御で断った要求。Retry-After と待ち順の目安を返す。"""
+    return jsonify(e.to_dict()), e.status, {'Retry-After': str(e.retry_after)}
+
+
+@app.route('/metrics')
+def metrics():
+    """工程別の所要時間・バイト数のヒストグラム（Prometheus テキスト形式）。"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
 def index():
-    appendix2_files = []
-    if os.path.isdir(APPENDIX2_DIR):
-        appendix2_files = [f for f in os.listdir(APPENDIX2_DIR)
-                           if f.endswith(('.docx', '.xlsx', '.pdf'))]
+    appendix2_files = list_appendix2_files(APPENDIX2_DIR)
     return render_template('index.html', file_types=FILE_TYPES,
-                           appendix2_files=appendix2_files)
+                           appendix2_files=appendix2_files,
+                           pdf_profiles=PDF_PROFILES, default_pdf_profile=PDF_PROFILE)
 
 
 @app.route('/process', methods=['POST'])
 def process_files():
+    from processors.bundle import build_bundle
+    from processors.package import process_package, package_members
+
     company_name = request.form.get('company_name', '').strip()
     if not company_name:
         return jsonify({'error': '会社名を入力してください。'}), 400
 
     approval_type = request.form.get('approval_type', 'paper')  # paper or electronic
     appendix2_choice = request.form.get('appendix2_choice', '')
+    pdf_profile = request.form.get('pdf_profile', '') or PDF_PROFILE
+    if pdf_profile not in PDF_PROFILES:
+        return jsonify({'error': f'未対応のPDFプロファイルです: {pdf_profile}'}), 400
+    output_mode = request.form.get('output_mode', '') or 'zip'
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({'error': f'未対応の出力形式です: {output_mode}'}), 400
+    session_id = _session_id()
+
+    started = admission.admit_now()
+    try:
+        work_dir, uploaded_docs, results = _stage_uploads()
+        if not uploaded_docs:
+            shutil.rmtree(work_dir)
+            return jsonify({'error': '少なくとも1つのファイルをアップロードしてください。'}), 400
+
+        output_dir = os.path.join(work_dir, 'output')
+        backup_dir = os.path.join(work_dir, 'backup')
+
+        try:
+            documents = process_package(uploaded_docs, output_dir, company_name, approval_type,
+                                        appendix2_choice, APPENDIX2_DIR, results, session_id=session_id,
+                                        pdf_profile=pdf_profile)
+            if output_mode == 'pdf':
+                bundle_path = os.path.join(work_dir, 'bundle.pdf')
+                build_bundle(bundle_path, documents, results)
+        except Exception as e:
+            logger.error(f"Processing error: {str(e)}\n{traceback.format_exc()}")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            observe(results['timings'])
+            return jsonify({'error': f'処理中にエラーが発生しました: {str(e)}',
+                            'timings': results['timings']}), 500
+        observe(results['timings'])
+    finally:
+        admission.finish(started)
+
+    # Stream ZIP with output + backup (or the merged PDF); work_dir is removed once the response is closed
+    if output_mode == 'pdf':
+        response = send_file(bundle_path, mimetype='application/pdf')
+    else:
+        response = Response(_timed_zip(package_members(output_dir, backup_dir)), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment',
+                         **_filename_options(_download_name(company_name, output_mode)))
+    response.headers['Server-Timing'] = server_timing(results['timings'])
+    response.headers['X-Session-Id'] = session_id
+    response.call_on_close(lambda: shutil.rmtree(work_dir, ignore_errors=True))
+    return response
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """/process と同じ入力を受け付け、処理をバックグラウンドに回してジョブIDを即時返す。"""
+    company_name = request.form.get('company_name', '').strip()
+    if not company_name:
+        return jsonify({'error': '会社名を入力してください。'}), 400
+
+    approval_type = request.form.get('approval_type', 'paper')
+    appendix2_choice = request.form.get('appendix2_choice', '')
+    pdf_profile = request.form.get('pdf_profile', '') or PDF_PROFILE
+    if pdf_profile not in PDF_PROFILES:
+        return jsonify({'error': f'未対応のPDFプロファイルです: {pdf_profile}'}), 400
+    output_mode = request.form.get('output_mode', '') or 'zip'
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({'error': f'未対応の出力形式です: {output_mode}'}), 400
+    session_id = _session_id()
+
+    work_dir, uploaded_docs, results = _stage_uploads()
+    if not uploaded_docs:
+        shutil.rmtree(work_dir)
+        return jsonify({'error': '少なくとも1つのファイルをアップロードしてください。'}), 400
+
+    try:
+        job = job_manager.submit(
+            work_dir, results, _download_name(company_name, output_mode),
+            documents={key: FILE_TYPES[key]['label'] for key in uploaded_docs},
+            task=package_task(uploaded_docs, output_mode,
+                              company_name=company_name, approval_type=approval_type,
+                              appendix2_choice=appendix2_choice, appendix2_dir=APPENDIX2_DIR,
+                              session_id=session_id, pdf_profile=pdf_profile),
+        )
+    except Rejected:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    return jsonify({
+        'job_id': job.id,
+        'session_id': session_id,
+        'queue_position': admission.position(job.id),
+        'status_url': f'/jobs/{job.id}',
+        'result_url': f'/jobs/{job.id}/result',
+    }), 202
+
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """会社フォルダを含むZIP（archive）と任意の manifest.csv（manifest）を受け付け、一括処理ジョブを作る。"""
+    from processors.batch import MANIFEST_NAME, company_key, discover_companies, extract_archive
+
+    archive = request.files.get('archive')
+    if not archive or not archive.filename:
+        return jsonify({'error': '会社ごとのフォルダをまとめたZIPをアップロードしてください。'}), 400
+
+    approval_type = request.form.get('approval_type', 'paper')
+    appendix2_choice = request.form.get('appendix2_choice', '')
+
+    work_dir = tempfile.mkdtemp()
+    input_dir = os.path.join(work_dir, 'input')
+    os.makedirs(input_dir)
+    try:
+        archive_path = os.path.join(work_dir, 'input.zip')
+        archive.save(archive_path)
+        extract_archive(archive_path, input_dir)
+        os.remove(archive_path)
+        manifest = request.files.get('manifest')
+        if manifest and manifest.filename:
+            manifest.save(os.path.join(input_dir, MANIFEST_NAME))
+        companies = discover_companies(input_dir, approval_type, appendix2_choice)
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return jsonify({'error': f'入力を読み込めませんでした: {str(e)}'}), 400
+
+    if not companies:
+        shutil.rmtree(work_dir)
+        return jsonify({'error': '処理対象の会社フォルダが見つかりません。'}), 400
+
+    results = {'processed': [], 'errors': [], 'warnings': [], 'timings': []}
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    try:
+        job = job_manager.submit(
+            work_dir, results, f'契約書一括_{timestamp}.zip',
+            documents={company_key(i): c['company_name'] or c['folder'] for i, c in enumerate(companies)},
+            task=batch_task(companies, APPENDIX2_DIR),
+        )
+    except Rejected:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    return jsonify({
+        'job_id': job.id,
+        'queue_position': admission.position(job.id),
+        'companies': len(companies),
+        'status_url': f'/jobs/{job.id}',
+        'result_url': f'/jobs/{job.id}/result',
+    }), 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """ジョブの状態と書類ごとの進捗（processed / converted / failed）を返す。"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません。'}), 404
+    return jsonify(job_manager.status(job))
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """完了したジョブのZIPを返す。"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません。'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify({'error': '処理が完了していません。', 'status': job.status}), 409
+    return send_file(job.result_path, mimetype=job.mimetype,
+                     as_attachment=True, download_name=job.download_name)
+
+
+def _session_id():
+    """フォームの session_id（前回の提出）を引き継ぐ。無い・不正な値なら新しく発行する。
+
+    同じ session_id で再提出すると、変更の無い書類は前回の成果物を再利用する。
+    """
+    from processors.session_store import new_session_id, valid_session_id
+
+    session_id = request.form.get('session_id', '')
+    return session_id if valid_session_id(session_id) else new_session_id()
+
+
+def _stage_uploads():
+    """アップロードを作業ディレクトリに保存し、元ファイル名でバックアップを作る。
+
+    戻り値は (work_dir, {書類キー: 保存先パス}, results)。
+    """
+    from processors.package import stage_document
 
     work_dir = tempfile.mkdtemp()
     output_dir = os.path.join(work_dir, 'output')
@@ -68,134 +273,71 @@ def process_files():
     os.makedirs(output_dir)
     os.makedirs(backup_dir)
 
-    results = {'processed': [], 'errors': [], 'warnings': []}
+    results = {'processed': [], 'errors': [], 'warnings': [], 'timings': []}
     uploaded_docs = {}
 
     # Save uploaded files and create backups
     for key in FILE_TYPES:
         file = request.files.get(key)
         if file and file.filename:
-            # secure_filename strips Japanese chars, so preserve extension manually
-            original_name = file.filename
-            ext = os.path.splitext(original_name)[1].lower()
-            safe_name = f'{key}_{uuid.uuid4().hex[:8]}{ext}'
-            filepath = os.path.join(work_dir, safe_name)
-            file.save(filepath)
-            uploaded_docs[key] = filepath
-            # Backup original with original filename (sanitised minimally)
-            backup_name = original_name.replace('/', '_').replace('\\', '_')
-            shutil.copy2(filepath, os.path.join(backup_dir, backup_name))
+            uploaded_docs[key] = stage_document(key, file.filename, file.save, work_dir, backup_dir,
+                                                results['timings'])
         else:
             results['warnings'].append(f'{FILE_TYPES[key]["label"]} がスキップされました（未アップロード）。')
 
-    if not uploaded_docs:
-        shutil.rmtree(work_dir)
-        return jsonify({'error': '少なくとも1つのファイルをアップロードしてください。'}), 400
+    return work_dir, uploaded_docs, results
 
-    # Process each document
-    entity_infos = {}
-    logger.info(f"Processing {len(uploaded_docs)} files for company: {company_name}")
 
-    try:
-        if 'contract' in uploaded_docs:
-            logger.info("Processing contract...")
-            res = process_contract(
-                uploaded_docs['contract'], output_dir, company_name,
-                approval_type, appendix2_choice, APPENDIX2_DIR
-            )
-            results['processed'].append(res['output_name'])
-            results['errors'].extend(res.get('errors', []))
-            results['warnings'].extend(res.get('warnings', []))
-            if res.get('entity_info'):
-                entity_infos['contract'] = res['entity_info']
-
-        if 'estimate' in uploaded_docs:
-            res = process_estimate(uploaded_docs['estimate'], output_dir, company_name)
-            results['processed'].append(res['output_name'])
-            results['errors'].extend(res.get('errors', []))
-            if res.get('entity_info'):
-                entity_infos['estimate'] = res['entity_info']
-
-        if 'oath' in uploaded_docs:
-            res = process_oath(uploaded_docs['oath'], output_dir, company_name)
-            results['processed'].append(res['output_name'])
-            results['errors'].extend(res.get('errors', []))
-            results['warnings'].extend(res.get('warnings', []))
-            if res.get('entity_info'):
-                entity_infos['oath'] = res['entity_info']
-
-        if 'checklist' in uploaded_docs:
-            res = process_checklist(uploaded_docs['checklist'], output_dir, company_name)
-            results['processed'].append(res['output_name'])
-            results['errors'].extend(res.get('errors', []))
-            if res.get('entity_info'):
-                entity_infos['checklist'] = res['entity_info']
-
-        if 'confirmation' in uploaded_docs:
-            res = process_confirmation(uploaded_docs['confirmation'], output_dir, company_name)
-            results['processed'].append(res['output_name'])
-            results['errors'].extend(res.get('errors', []))
-            if res.get('entity_info'):
-                entity_infos['confirmation'] = res['entity_info']
-
-        # Cross-check entity info
-        if len(entity_infos) > 1:
-            cross_errors = cross_check_entities(entity_infos)
-            results['errors'].extend(cross_errors)
-
-        # Convert all output docx/xlsx to PDF
-        logger.info(f"Converting files to PDF in {output_dir}")
-        for fname in os.listdir(output_dir):
-            fpath = os.path.join(output_dir, fname)
-            if fname.endswith(('.docx', '.xlsx')):
-                try:
-                    logger.info(f"Converting {fname} to PDF...")
-                    pdf_path = convert_to_pdf(fpath)
-                    logger.info(f"Converted: {pdf_path}")
-                    os.remove(fpath)
-                except Exception as e:
-                    logger.error(f"PDF conversion failed for {fname}: {str(e)}\n{traceback.format_exc()}")
-                    results['warnings'].append(f'{fname} のPDF変換に失敗: {str(e)}。元ファイルを同梱します。')
-
-        # Create ZIP with output + backup
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for fname in os.listdir(output_dir):
-                zf.write(os.path.join(output_dir, fname), f'成果物/{fname}')
-            for fname in os.listdir(backup_dir):
-                zf.write(os.path.join(backup_dir, fname), f'バックアップ/{fname}')
-
-        zip_buffer.seek(0)
-        shutil.rmtree(work_dir)
+def _timed_zip(members):
+    """iter_zip の全チャンクを送り終えるまでを 'zip' 工程として記録する。"""
+    from processors.package import iter_zip
 
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        return send_file(
-            zip_buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'契約書_{company_name}_{timestamp}.zip'
-        )
+    timings = []
+    with timed(timings, 'zip') as entry:
+        entry['bytes'] = 0
+        for chunk in iter_zip(members):
+            entry['bytes'] += len(chunk)
+            yield chunk
+    observe(timings)
+
+
+def _filename_options(download_name):
+    """Content-Disposition の filename / filename* (RFC 5987) を作る。send_file と同じ形式。"""
+    simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    return {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+-.^_`|~')}"}
 
-    except Exception as e:
-        logger.error(f"Processing error: {str(e)}\n{traceback.format_exc()}")
-        shutil.rmtree(work_dir, ignore_errors=True)
-        return jsonify({'error': f'処理中にエラーが発生しました: {str(e)}'}), 500
+
+def _download_name(company_name, output_mode='zip'):
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'契約書_{company_name}_{timestamp}.{output_mode}'
 
 
 @app.route('/validate', methods=['POST'])
 def validate_only():
-    """Run validation checks without producing output files."""
+    """Run validation checks without producing output files.
+
+    アップロードをディスクに保存せず本文XMLを流し読みし、整形・保存・PDF変換を省いてチェックだけ行う。
+    """
+    from processors.validation import validate_package
+
     company_name = request.form.get('company_name', '').strip()
     approval_type = request.form.get('approval_type', 'paper')
-    results = {'errors': [], 'warnings': []}
+    results = {'errors': [], 'warnings': [], 'timings': []}
 
     if not company_name:
         results['errors'].append('会社名を入力してください。')
 
-    uploaded_count = sum(1 for key in FILE_TYPES if request.files.get(key) and request.files[key].filename)
-    if uploaded_count == 0:
+    documents = {key: (request.files[key].stream, request.files[key].filename)
+                 for key in FILE_TYPES if request.files.get(key) and request.files[key].filename}
+    if not documents:
         results['errors'].append('少なくとも1つのファイルをアップロードしてください。')
+        return jsonify(results)
 
+    checked = validate_package(documents, approval_type)
+    results['errors'].extend(checked['errors'])
+    results['warnings'].extend(checked['warnings'])
+    results['timings'].extend(checked['timings'])
+    observe(results['timings'])
     return jsonify(results)
 
 
@@ -0,0 +1,67 @@
+"""clean_formatting の実装比較ベンチマーク（xml エンジン vs reference）
+
+使い方:
+    python benchmarks/bench_clean_formatting.py [--paragraphs 2000] [--runs 10] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docx import Document
+from docx.enum.text import WD_COLOR_INDEX
+from docx.shared import RGBColor
+
+from processors.common import clean_formatting
+from processors.docx_io import open_docx
+
+
+def build_document(path, paragraphs, runs):
+    """太字・色・ハイライト付きのランを大量に含む文書を作る。"""
+    doc = Document()
+    for i in range(paragraphs):
+        para = doc.add_paragraph()
+        for j in range(runs):
+            run = para.add_run(f'第{i}条 本文{j} ')
+            if j % 2 == 0:
+                run.bold = True
+                run.font.color.rgb = RGBColor(0xC0, 0, 0)
+            if j % 3 == 0:
+                run.font.highlight_color = WD_COLOR_INDEX.YELLOW
+    doc.save(path)
+
+
+def bench(path, mode, repeat):
+    timings = []
+    for _ in range(repeat):
+        # processors と同じく open_docx で読み込む（clean_formatting はヘッダー等・コメントの取得に使う）
+        doc = open_docx(path)
+        start = time.perf_counter()
+        clean_formatting(doc, mode=mode)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--paragraphs', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.docx')
+        build_document(path, args.paragraphs, args.runs)
+        total_runs = args.paragraphs * args.runs
+        print(f'{total_runs} runs ({args.paragraphs} paragraphs x {args.runs})')
+        results = {mode: bench(path, mode, args.repeat) for mode in ('reference', 'xml')}
+        for mode, elapsed in results.items():
+            print(f'{mode:>9}: {elapsed * 1000:8.1f} ms  ({total_runs / elapsed:,.0f} runs/s)')
+        print(f'  speedup: {results["reference"] / results["xml"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
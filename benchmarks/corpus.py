@@ -0,0 +1,136 @@
+"""ベンチマーク用の合成書類コーパス
+
+本番の書類に近い構成（条文・表・コメント・画像・カテゴリー及びパートナー・別紙2/3）の
+契約書と、誓約書・見積書・チェックシート・確認書を生成する。
+"""
+import io
+import os
+import struct
+import zlib
+
+from docx import Document
+from docx.enum.text import WD_BREAK, WD_COLOR_INDEX
+from docx.shared import RGBColor
+from openpyxl import Workbook
+
+PARAGRAPHS_PER_PAGE = 25
+APPENDIX2_TEMPLATE = '別紙2_最新.docx'
+
+ENTITY_LINES = [
+    '乙：株式会社ベンチマーク',
+    '住所：愛知県名古屋市中区三の丸1-1-1',
+    '代表取締役 名古屋太郎',
+]
+
+
+def _png(width=64, height=64):
+    """単色のPNG画像のバイト列（押印画像の代わり）。"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\0' + b'\xc0\x00\x00' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def _add_body(doc, pages, runs, tables, comments, label):
+    """条文段落・表・コメントを pages ページ分追加する。"""
+    commented = 0
+    for page in range(pages):
+        for i in range(PARAGRAPHS_PER_PAGE):
+            para = doc.add_paragraph()
+            for j in range(runs):
+                run = para.add_run(f'{label}第{page + 1}条{i + 1}項 文言{j}。')
+                if j % 3 == 0:
+                    run.bold = True
+                    run.font.color.rgb = RGBColor(0xC0, 0, 0)
+                if j % 5 == 0:
+                    run.font.highlight_color = WD_COLOR_INDEX.YELLOW
+            if commented < comments and hasattr(doc, 'add_comment'):
+                doc.add_comment(para.runs, text='確認してください', author='bench')
+                commented += 1
+        if tables and page % max(1, pages // tables) == 0:
+            table = doc.add_table(rows=4, cols=3)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f'項目{r}-{c}'
+        doc.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+
+
+def make_contract(path, pages=80, runs=4, tables=10, comments=20, appendices=True):
+    doc = Document()
+    doc.add_paragraph('愛知・名古屋2026大会における大会関係者の宿泊施設等の利用に関する基本契約書')
+    _add_body(doc, pages, runs, tables, comments, '')
+    doc.add_paragraph('令和8年 月 日')
+    doc.add_paragraph('本契約の成立を証するため、本書２通を作成し、甲乙署名又は記名捺印の上、各１通を保有するものとする。')
+    for line in ENTITY_LINES:
+        doc.add_paragraph(line)
+    doc.add_picture(io.BytesIO(_png()))
+    if appendices:
+        doc.add_paragraph('カテゴリー及びパートナー')
+        _add_body(doc, max(1, pages // 20), runs, 0, 0, 'パートナー')
+        doc.add_paragraph('別紙2')
+        doc.add_paragraph('愛知・名古屋2026 大会関係者宿泊仕様')
+        _add_body(doc, max(1, pages // 10), runs, 1, 0, '別紙2 ')
+        doc.add_paragraph('別紙3')
+        _add_body(doc, max(1, pages // 20), runs, 0, 0, '別紙3 ')
+    doc.save(path)
+
+
+def make_oath(path, pages=2, runs=3):
+    doc = Document()
+    doc.add_paragraph('第20回アジア競技大会における大会関係者の宿泊施設等の利用に関する基本契約書')
+    _add_body(doc, pages, runs, 0, 0, '誓約 ')
+    for line in ENTITY_LINES:
+        doc.add_paragraph(line)
+    doc.save(path)
+
+
+def make_confirmation(path, pages=1, runs=3):
+    doc = Document()
+    doc.add_paragraph('電子契約サービス利用確認書')
+    _add_body(doc, pages, runs, 1, 0, '確認 ')
+    for line in ENTITY_LINES:
+        doc.add_paragraph(line)
+    doc.save(path)
+
+
+def make_appendix2(path, pages=2, runs=3):
+    """別紙2差し替え用テンプレート（最新様式）。"""
+    doc = Document()
+    doc.add_paragraph('2026アジア・アジアパラ競技大会 大会関係者宿泊仕様')
+    _add_body(doc, pages, runs, 0, 0, '新別紙2 ')
+    doc.save(path)
+
+
+def make_workbook(path, rows=2000, cols=12, title='見積書'):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = title
+    for r, line in enumerate(ENTITY_LINES, start=1):
+        ws.cell(row=r, column=1, value=line)
+    for r in range(len(ENTITY_LINES) + 2, rows + 1):
+        for c in range(1, cols + 1):
+            ws.cell(row=r, column=c, value=r * c if c > 1 else f'品目{r}')
+    wb.save(path)
+
+
+def build_corpus(directory, pages=80, runs=4, tables=10, comments=20, xlsx_rows=2000):
+    """書類一式を directory に生成し、{書類キー: パス} を返す。
+
+    別紙2差し替え用テンプレートは directory/appendix2/ に置く。
+    """
+    os.makedirs(os.path.join(directory, 'appendix2'), exist_ok=True)
+    files = {
+        'contract': os.path.join(directory, 'contract.docx'),
+        'estimate': os.path.join(directory, 'estimate.xlsx'),
+        'oath': os.path.join(directory, 'oath.docx'),
+        'checklist': os.path.join(directory, 'checklist.xlsx'),
+        'confirmation': os.path.join(directory, 'confirmation.docx'),
+    }
+    make_contract(files['contract'], pages, runs, tables, comments)
+    make_workbook(files['estimate'], xlsx_rows)
+    make_oath(files['oath'], runs=runs)
+    make_workbook(files['checklist'], max(50, xlsx_rows // 20), 6, 'チェックシート')
+    make_confirmation(files['confirmation'], runs=runs)
+    make_appendix2(os.path.join(directory, 'appendix2', APPENDIX2_TEMPLATE), runs=runs)
+    return files
@@ -0,0 +1,334 @@
+"""書類処理パイプラインのベンチマーク（合成コーパス・工程別計測）
+
+書類ごとに 読込 → 各チェック → 書式クリーニング → 保存 → PDF変換 を工程別に計測し、
+最後に成果物一式のZIP作成を計測する。書類ごとに別プロセスで実行し、ピークRSSを測る。
+計測の前に、docx の保存（パーツの生コピー）で画像・コメントを含む文書が壊れないことを確かめる。
+結果はJSONで書き出し、--compare で以前の結果（別コミット）と比較できる。
+
+使い方:
+    python benchmarks/run_benchmarks.py [--pages 80] [--runs 4] [--repeat 3] [-o result.json]
+    python benchmarks/run_benchmarks.py --compare baseline.json
+    python benchmarks/run_benchmarks.py --profiles archive,balanced,web
+
+PDF変換は LibreOffice が見つからない場合スキップする。変換キャッシュは計測のため無効にする。
+--profiles を指定すると PDF出力プロファイルごとに変換時間（工程名 pdf:<プロファイル>）とPDFのサイズを計測する。
+常駐プールの有無は OFFICE_POOL_SIZE で切り替える（プール起動時間は1回目の変換に含まれる）。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['PDF_CACHE_MAX_MB'] = '0'
+
+from benchmarks.corpus import build_corpus, APPENDIX2_TEMPLATE, PARAGRAPHS_PER_PAGE
+
+COMPANY = 'ベンチマーク'
+
+
+# --- 書類ごとの工程 ---
+
+def _docx_stages(key):
+    """docx 書類の工程リスト [(工程名, fn(state))]。state は1回分の処理状態。"""
+    from processors.common import ParagraphIndex, clean_formatting, extract_entity_info
+    from processors import contract, oath
+    from processors.docx_io import open_docx
+    from processors.rules import RULES
+
+    stages = [('load', lambda s: s.update(doc=open_docx(s['src'])))]
+    if key == 'contract':
+        stages += [
+            ('index', lambda s: s.update(index=ParagraphIndex(s['doc'], RULES))),
+            ('check_date_fields', lambda s: contract._check_date_fields(s['index'], s['result'])),
+            ('check_seal_clause', lambda s: contract._check_seal_clause_exists(s['index'], s['result'])),
+            ('check_appendix2_version', lambda s: contract._check_appendix2_version(s['index'], s['result'])),
+            ('remove_partner_pages', lambda s: contract._remove_partner_pages(s['index'], s['result'])),
+            ('replace_appendix2', lambda s: contract._replace_appendix2(
+                s['index'], APPENDIX2_TEMPLATE, s['appendix2_dir'], s['result'])),
+            ('clean_formatting', lambda s: clean_formatting(s['doc'], s['index'])),
+            ('extract_entity_info', lambda s: extract_entity_info(s['doc'], s['index'])),
+        ]
+    else:
+        if key == 'oath':
+            stages += [
+                ('fix_title', lambda s: oath._fix_title(s['doc'], s['result'])),
+                ('check_signature', lambda s: oath._check_signature(
+                    '\n'.join(p.text for p in s['doc'].paragraphs), s['result'])),
+            ]
+        stages += [
+            ('clean_formatting', lambda s: clean_formatting(s['doc'])),
+            ('extract_entity_info', lambda s: extract_entity_info(s['doc'])),
+        ]
+    stages.append(('save', lambda s: s['doc'].save(s['out'])))
+    return stages
+
+
+def _xlsx_stages():
+    """xlsx は内容を変更しないため素通しし、エンティティ情報だけ抽出する（processors と同じ）。"""
+    from processors.common import is_xlsx, link_or_copy
+    from processors.extractors import extract_entity_info_from_xlsx
+
+    def passthrough(s):
+        if os.path.exists(s['out']):
+            os.remove(s['out'])
+        if is_xlsx(s['src']):
+            link_or_copy(s['src'], s['out'])
+
+    return [
+        ('passthrough', passthrough),
+        ('extract_entity_info', lambda s: s.update(entity_info=extract_entity_info_from_xlsx(s['src']))),
+    ]
+
+
+def _convert_stage(profile):
+    """PDF変換の工程。profile が None なら既定のプロファイルで、工程名は 'pdf'。"""
+    def convert(state):
+        from processors.pdf_converter import convert_to_pdf
+        pdf_path = convert_to_pdf(state['out'], profile)
+        state['pdf_bytes'][profile or 'default'] = os.path.getsize(pdf_path)
+    return (f'pdf:{profile}' if profile else 'pdf'), convert
+
+
+def bench_document(key, src, out_dir, appendix2_dir, repeat, profiles):
+    """1書類を repeat 回処理し、工程別の所要時間（秒）のリスト・PDFサイズ・ピークRSSを返す。
+
+    profiles は計測するPDF出力プロファイルのリスト（空ならPDF変換しない）。
+    別プロセスで呼ばれる前提（ピークRSSはこのプロセスの最大値）。
+    """
+    ext = os.path.splitext(src)[1]
+    stages = _xlsx_stages() if ext == '.xlsx' else _docx_stages(key)
+    for profile in profiles:
+        stages.append(_convert_stage(profile))
+    with_pdf = bool(profiles)
+
+    out = os.path.join(out_dir, f'{key}_{COMPANY}{ext}')
+    timings = {name: [] for name, _ in stages}
+    totals = []
+    pdf_bytes = {}
+    for _ in range(repeat):
+        state = {'src': src, 'out': out, 'appendix2_dir': appendix2_dir,
+                 'result': {'errors': [], 'warnings': []}, 'pdf_bytes': pdf_bytes}
+        started = time.perf_counter()
+        for name, fn in stages:
+            t0 = time.perf_counter()
+            fn(state)
+            timings[name].append(time.perf_counter() - t0)
+        totals.append(time.perf_counter() - started)
+    if with_pdf and os.path.exists(out):
+        os.remove(out)
+    return {'stages': timings, 'total': totals, 'pdf_bytes': pdf_bytes, 'peak_rss_mb': peak_rss_mb()}
+
+
+def peak_rss_mb():
+    """このプロセスのピークRSS（MB）。resource が無い環境では None。"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def bench_zip(out_dir, backup_dir, repeat):
+    from processors.package import package_members, write_zip
+    timings = []
+    with tempfile.TemporaryFile() as f:
+        for _ in range(repeat):
+            f.seek(0)
+            f.truncate()
+            t0 = time.perf_counter()
+            write_zip(f, package_members(out_dir, backup_dir))
+            timings.append(time.perf_counter() - t0)
+        size = f.tell()
+    return {'stages': {'zip': timings}, 'total': timings, 'bytes': size}
+
+
+def check_roundtrip(src, out_dir):
+    """src を open_docx で読み込んで保存し直し、ZIPとして壊れておらず python-docx で開けること、
+    解析しないパーツ（画像・コメントなど）が元と同じ内容であることを確かめる。問題があれば RuntimeError。
+    """
+    import zipfile
+    from docx import Document
+    from processors.docx_io import open_docx
+
+    out = os.path.join(out_dir, 'roundtrip_' + os.path.basename(src))
+    doc = open_docx(src)
+    doc.save(out)
+    try:
+        with zipfile.ZipFile(src) as before, zipfile.ZipFile(out) as after:
+            bad = after.testzip()
+            if bad is not None:
+                raise RuntimeError(f'{src}: 保存後の {bad} のCRCが一致しません')
+            if set(before.namelist()) != set(after.namelist()):
+                raise RuntimeError(f'{src}: 保存後のパーツ構成が変わりました')
+            for name in before.namelist():
+                if name not in doc._parts and before.read(name) != after.read(name):
+                    raise RuntimeError(f'{src}: 保存後の {name} の内容が変わりました')
+        Document(out)
+    finally:
+        os.remove(out)
+
+
+def _summarize(samples):
+    return {'min': round(min(samples), 6), 'median': round(statistics.median(samples), 6)}
+
+
+def _libreoffice_available():
+    from processors.pdf_converter import _find_libreoffice
+    return _find_libreoffice() is not None
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    with_pdf = not args.no_pdf and _libreoffice_available()
+    if not args.no_pdf and not with_pdf:
+        print('LibreOffice が見つからないため PDF変換の計測をスキップします。', file=sys.stderr)
+    profiles = (args.profiles.split(',') if args.profiles else [None]) if with_pdf else []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = os.path.join(tmp, 'corpus')
+        out_dir = os.path.join(tmp, 'output')
+        backup_dir = os.path.join(tmp, 'backup')
+        os.makedirs(out_dir)
+        files = build_corpus(corpus_dir, args.pages, args.runs, args.tables,
+                             args.comments, args.xlsx_rows)
+        shutil.copytree(corpus_dir, backup_dir, ignore=shutil.ignore_patterns('appendix2'))
+        appendix2_dir = os.path.join(corpus_dir, 'appendix2')
+        for src in files.values():
+            if src.endswith('.docx'):
+                check_roundtrip(src, out_dir)
+
+        documents = {}
+        ctx = multiprocessing.get_context('spawn')
+        for key, src in files.items():
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                res = executor.submit(bench_document, key, src, out_dir, appendix2_dir,
+                                      args.repeat, profiles).result()
+            documents[key] = {
+                'bytes': os.path.getsize(src),
+                'stages': {name: _summarize(v) for name, v in res['stages'].items()},
+                'total': _summarize(res['total']),
+                'pdf_bytes': res['pdf_bytes'],
+                'peak_rss_mb': res['peak_rss_mb'],
+            }
+        zipped = bench_zip(out_dir, backup_dir, args.repeat)
+
+    input_bytes = sum(d['bytes'] for d in documents.values())
+    processing = sum(d['total']['min'] for d in documents.values())
+    package_time = processing + min(zipped['total'])
+    # 本文 + カテゴリー及びパートナー・別紙2・別紙3（corpus.make_contract と同じ構成）
+    pages = args.pages + 2 * max(1, args.pages // 20) + max(1, args.pages // 10)
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'pages': args.pages, 'runs': args.runs, 'tables': args.tables,
+            'comments': args.comments, 'xlsx_rows': args.xlsx_rows,
+            'repeat': args.repeat, 'pdf': with_pdf, 'profiles': args.profiles,
+            'paragraphs_per_page': PARAGRAPHS_PER_PAGE,
+        },
+        'documents': documents,
+        'zip': {'stages': {'zip': _summarize(zipped['stages']['zip'])}, 'bytes': zipped['bytes']},
+        'throughput': {
+            'packages_per_min': round(60 / package_time, 2),
+            'contract_pages_per_sec': round(pages / documents['contract']['total']['min'], 1),
+            'input_mb_per_sec': round(input_bytes / processing / 1e6, 2),
+        },
+        'peak_rss_mb': max((d['peak_rss_mb'] or 0) for d in documents.values()) or None,
+    }
+
+
+# --- 表示・比較 ---
+
+def report(data):
+    print(f"commit {data['commit'] or '-'}  python {data['python']}  "
+          f"pages={data['params']['pages']} runs={data['params']['runs']} "
+          f"repeat={data['params']['repeat']} pdf={data['params']['pdf']}")
+    for key, doc in data['documents'].items():
+        print(f"{key:<13} {doc['total']['min'] * 1000:9.1f} ms  peak RSS {doc['peak_rss_mb']} MB")
+        for name, stat in doc['stages'].items():
+            print(f"  {name:<24} {stat['min'] * 1000:9.1f} ms  (median {stat['median'] * 1000:.1f})")
+        for profile, size in doc.get('pdf_bytes', {}).items():
+            print(f"  {'pdf size (' + profile + ')':<24} {size / 1e3:9.1f} KB")
+    print(f"{'zip':<13} {data['zip']['stages']['zip']['min'] * 1000:9.1f} ms  "
+          f"{data['zip']['bytes'] / 1e6:.1f} MB")
+    t = data['throughput']
+    print(f"throughput: {t['packages_per_min']} packages/min, "
+          f"{t['contract_pages_per_sec']} contract pages/s, {t['input_mb_per_sec']} MB/s")
+
+
+def _flatten(data):
+    rows = {}
+    for key, doc in data['documents'].items():
+        rows[f'{key}.total'] = doc['total']['min']
+        for name, stat in doc['stages'].items():
+            rows[f'{key}.{name}'] = stat['min']
+    rows['zip'] = data['zip']['stages']['zip']['min']
+    return rows
+
+
+def compare(baseline, current):
+    """工程別の最小時間を比較表示する。比 < 1 なら current が速い。"""
+    if baseline['params'] != current['params']:
+        print('警告: 計測条件（params）が異なります。', file=sys.stderr)
+    print(f"baseline {baseline['commit'] or '-'} → current {current['commit'] or '-'}")
+    old, new = _flatten(baseline), _flatten(current)
+    for name in new:
+        if name not in old:
+            print(f"  {name:<38} {'':>10} {new[name] * 1000:9.1f} ms  (new)")
+            continue
+        ratio = new[name] / old[name] if old[name] else float('inf')
+        print(f"  {name:<38} {old[name] * 1000:9.1f} → {new[name] * 1000:9.1f} ms  x{ratio:.2f}")
+    print(f"  {'peak_rss_mb':<38} {baseline['peak_rss_mb']} → {current['peak_rss_mb']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=80, help='契約書本文のページ数')
+    parser.add_argument('--runs', type=int, default=4, help='1段落あたりのラン数')
+    parser.add_argument('--tables', type=int, default=10)
+    parser.add_argument('--comments', type=int, default=20)
+    parser.add_argument('--xlsx-rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-pdf', action='store_true', help='PDF変換を計測しない')
+    parser.add_argument('--profiles', help='計測するPDF出力プロファイル（カンマ区切り、例: archive,balanced,web）')
+    parser.add_argument('-o', '--output', help='結果JSONの出力先')
+    parser.add_argument('--compare', metavar='BASELINE', help='比較対象の結果JSON')
+    args = parser.parse_args()
+
+    data = run(args)
+    report(data)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""非同期ジョブ管理 — /jobs・/batch API 用のプロセス内キューとワーカー
+
+外部ブローカーは使わず、gunicorn ワーカー内のスレッドプールでジョブを実行する。
+ジョブの状態はメモリ上に保持し、成果物ZIPは作業ディレクトリに書き出す。
+完了から JOB_TTL 秒経過したジョブは作業ディレクトリごと破棄する。
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import AdmissionController
+from processors.metrics import timed, observe
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_TTL = int(os.environ.get('JOB_TTL', '3600'))
+
+RESULT_MIMETYPES = {'.zip': 'application/zip', '.pdf': 'application/pdf'}
+
+
+class Job:
+    """1件の処理ジョブ。documents は {キー: 表示名} で、キーごとに進捗を持つ。task(job) で処理を実行する。"""
+
+    def __init__(self, work_dir, results, download_name, documents, task):
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.work_dir = work_dir
+        self.results = results
+        self.download_name = download_name
+        self.status = 'queued'
+        self.error = ''
+        self.documents = {key: {'label': label, 'state': 'pending'}
+                          for key, label in documents.items()}
+        # 成果物の形式はダウンロード名の拡張子（.zip / .pdf）で決まる
+        ext = os.path.splitext(download_name)[1]
+        self.result_path = os.path.join(work_dir, 'result' + ext)
+        self.mimetype = RESULT_MIMETYPES.get(ext, 'application/octet-stream')
+        self.created = time.time()
+        self.finished = None
+
+    def set_progress(self, key, state):
+        self.documents[key]['state'] = state
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'documents': self.documents,
+            'processed': self.results['processed'],
+            'errors': self.results['errors'],
+            'warnings': self.results['warnings'],
+            'timings': self.results['timings'],
+        }
+
+
+class JobManager:
+    """ジョブの受付・実行・参照・期限切れ削除を行う。
+
+    受付と実行開始は admission（AdmissionController）を通し、待ち行列の上限と同時実行数を守る。
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL, admission=None):
+        self.ttl = ttl
+        self.admission = admission or AdmissionController()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, work_dir, results, download_name, documents, task):
+        """task(job) をキューに積み、Job を返す。task は job.result_path に成果物（ZIPまたは結合PDF）を書き出す。
+
+        待ち行列が満杯・メモリ不足の場合は admission.Rejected を送出する。
+        """
+        self._purge_expired()
+        job = Job(work_dir, results, download_name, documents, task)
+        # 待ち行列に入れた時点で他のスレッドが取り出し得るので、先に登録しておく
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self.admission.enqueue(job.id)
+        except Exception:
+            with self._lock:
+                del self._jobs[job.id]
+            raise
+        try:
+            # 実行するジョブは _run_next が待ち行列の先頭から選ぶので、submit の順序は問わない
+            self._executor.submit(self._run_next)
+        except Exception:
+            self.admission.cancel(job.id)
+            with self._lock:
+                del self._jobs[job.id]
+            raise
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job):
+        """ジョブの状態。待機中なら順番と開始までの見込み秒数も返す。"""
+        data = job.to_dict()
+        if job.status == 'queued':
+            position = self.admission.position(job.id)
+            if position is not None:
+                data['queue_position'] = position
+                data['retry_after'] = self.admission.estimate_wait(position)
+        return data
+
+    def _run_next(self):
+        """実行枠が空いたら、待ち行列の先頭のジョブを実行する。"""
+        ticket, started = self.admission.start_next()
+        with self._lock:
+            job = self._jobs[ticket]
+        job.status = 'running'
+        try:
+            job.task(job)
+            job.status = 'done'
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}\n{traceback.format_exc()}")
+            job.error = f'処理中にエラーが発生しました: {str(e)}'
+            job.status = 'failed'
+        finally:
+            self.admission.finish(started)
+            job.finished = time.time()
+            observe(job.results['timings'])
+
+    def _purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [j for j in self._jobs.values()
+                       if j.finished is not None and now - j.finished > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+
+def package_task(uploaded_docs, output_mode='zip', **options):
+    """1社分の書類一式を処理してZIP（output_mode='pdf' なら結合PDF）を書き出すタスクを作る。
+
+    options は process_package の company_name / approval_type /
+    appendix2_choice / appendix2_dir / session_id / pdf_profile。
+    """
+    from processors.bundle import build_bundle
+    from processors.package import process_package, package_members, write_zip
+
+    def task(job):
+        output_dir = os.path.join(job.work_dir, 'output')
+        backup_dir = os.path.join(job.work_dir, 'backup')
+        documents = process_package(uploaded_docs, output_dir, results=job.results,
+                                    progress=job.set_progress, **options)
+        if output_mode == 'pdf':
+            build_bundle(job.result_path, documents, job.results)
+            return
+        with timed(job.results['timings'], 'zip', path=job.result_path), open(job.result_path, 'wb') as f:
+            write_zip(f, package_members(output_dir, backup_dir))
+    return task
+
+
+def batch_task(companies, appendix2_dir):
+    """複数社を一括処理して結合ZIPを書き出すタスクを作る。エラー・警告には会社名を付ける。"""
+    from processors.batch import run_batch
+    from processors.package import write_zip
+
+    def task(job):
+        members, summaries = run_batch(companies, job.work_dir, appendix2_dir,
+                                       progress=job.set_progress)
+        for company, results in summaries:
+            name = company['company_name'] or company['folder']
+            job.results['processed'].extend(p for p in results['processed'] if p)
+            job.results['errors'].extend(f'[{name}] {m}' for m in results['errors'])
+            job.results['warnings'].extend(f'[{name}] {m}' for m in results['warnings'])
+            job.results['timings'].extend(dict(entry, company=name) for entry in results['timings'])
+        with timed(job.results['timings'], 'zip', path=job.result_path), open(job.result_path, 'wb') as f:
+            write_zip(f, members)
+    return task
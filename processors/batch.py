@@ -0,0 +1,373 @@
+"""複数社の一括処理（バッチモード）
+
+入力は会社ごとのフォルダを並べたディレクトリ、またはそれをまとめたZIP。
+フォルダ内の各ファイルはファイル名から書類種別を判定する。
+manifest.csv（company_name, approval_type, appendix2_choice[, folder]）があれば、
+会社ごとの決裁種別・別紙2の選択に使う。無ければフォルダ名を会社名とする。
+manifest に記載の無い会社フォルダは処理せず、一覧に「対象外」として載せる。
+
+各社の書類処理はプロセスプールで並列に行い、PDF変換は親プロセスの変換プールを共有する。
+結果は1つのZIPにまとめ、会社ごとのエラー・警告を一覧CSVに出力する。
+
+CLI:
+    python -m processors.batch 入力(ディレクトリ|ZIP|manifest.csv) -o 出力.zip
+
+フォルダが見つからない・書類が1通も無い会社（未処理）があれば終了コード 1 を返す。
+"""
+import argparse
+import csv
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .common import link_or_copy
+from .package import (FILE_TYPES, PDF_CONVERT_WORKERS, stage_document, process_documents,
+                      convert_outputs, package_members, write_zip)
+
+logger = logging.getLogger(__name__)
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', str(os.cpu_count() or 2)))
+DEFAULT_APPENDIX2_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'assets', 'appendix2')
+MANIFEST_NAME = 'manifest.csv'
+SUMMARY_NAME = '処理結果一覧.csv'
+
+# ファイル名から書類種別を判定するキーワード（先に一致したものを採用）
+SLOT_KEYWORDS = [
+    ('confirmation', ('confirmation', '確認書')),
+    ('checklist', ('checklist', 'チェックシート')),
+    ('oath', ('oath', '誓約書')),
+    ('estimate', ('estimate', '見積', '別紙１', '別紙1')),
+    ('contract', ('contract', '契約書')),
+]
+
+
+def detect_slot(filename):
+    """ファイル名から書類キーを判定する。判定できなければ None。"""
+    name = filename.lower()
+    for key, keywords in SLOT_KEYWORDS:
+        if any(kw in name for kw in keywords):
+            return key
+    return None
+
+
+def extract_archive(zip_path, dest):
+    """ZIPを展開する。UTF-8フラグの無いファイル名は UTF-8、CP932 の順に読み直す。"""
+    root = os.path.realpath(dest)
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            if not info.flag_bits & 0x800:
+                name = _decode_legacy_name(name)
+            target = os.path.realpath(os.path.join(dest, name))
+            if not target.startswith(root + os.sep):
+                raise ValueError(f'ZIP内に不正なパスがあります: {name}')
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zf.open(info) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+
+def _decode_legacy_name(name):
+    """cp437 として読まれたファイル名を、元のエンコーディング（UTF-8 / CP932）で読み直す。"""
+    try:
+        raw = name.encode('cp437')
+    except UnicodeEncodeError:
+        return name
+    for encoding in ('utf-8', 'cp932'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return name
+
+
+def discover_companies(root, approval_type='paper', appendix2_choice='', manifest_path=None):
+    """入力ディレクトリから会社ごとの処理対象を組み立てる。
+
+    manifest_path を省略すると root（または包みのフォルダ）の manifest.csv を使う。
+    戻り値は {'company_name', 'folder', 'approval_type', 'appendix2_choice',
+    'files': {書類キー: パス}, 'errors': [...], 'warnings': [...], 'unlisted': bool} のリスト。
+    フォルダが見つからない・書類が1通も無い会社は errors に理由を積む（処理はしない）。
+    manifest に記載の無い会社フォルダも unlisted=True で含める（処理はせず、一覧に載せる）。
+    """
+    # 会社フォルダを1階層のフォルダで包んだZIPにも対応する。/batch で別に受け取った
+    # manifest.csv は包みの外（root 直下）に置かれるので、包みを数えるときは除く
+    roots = [root]
+    while True:
+        entries = _entries(roots[-1])
+        if len(entries) != 1 or not os.path.isdir(os.path.join(roots[-1], entries[0])):
+            break
+        roots.append(os.path.join(roots[-1], entries[0]))
+    folders = sorted(d for d in entries if os.path.isdir(os.path.join(roots[-1], d)))
+
+    if manifest_path is None:
+        manifest_path = next((os.path.join(r, MANIFEST_NAME) for r in roots
+                              if os.path.exists(os.path.join(r, MANIFEST_NAME))), None)
+    if manifest_path is not None:
+        rows = load_manifest(manifest_path)
+    else:
+        rows = [{'company_name': d, 'folder': d} for d in folders]
+
+    companies = []
+    listed = set()
+    for row in rows:
+        company_name = row.get('company_name', '').strip()
+        folder = (row.get('folder') or company_name).strip()
+        company = _company(company_name, folder, (row.get('approval_type') or approval_type).strip(),
+                           (row.get('appendix2_choice') or appendix2_choice).strip())
+        companies.append(company)
+        # manifest のフォルダは包みの内側から順に探す
+        folder_path = next((os.path.join(r, folder) for r in reversed(roots)
+                            if folder and os.path.isdir(os.path.join(r, folder))), None)
+        if not company_name or folder_path is None:
+            company['errors'].append(f'フォルダが見つかりません: {folder}')
+            continue
+        listed.add(os.path.realpath(folder_path))
+        for fname in sorted(os.listdir(folder_path)):
+            path = os.path.join(folder_path, fname)
+            if not os.path.isfile(path) or fname.startswith('.'):
+                continue
+            key = detect_slot(fname)
+            if key is None:
+                company['warnings'].append(f'書類種別を判定できないためスキップしました: {fname}')
+            elif key in company['files']:
+                company['warnings'].append(
+                    f'{FILE_TYPES[key]["label"]} が複数あります。{fname} はスキップしました。')
+            else:
+                company['files'][key] = path
+        if not company['files']:
+            company['errors'].append(f'処理できる書類がありません: {folder}')
+
+    for folder in folders:
+        if os.path.realpath(os.path.join(roots[-1], folder)) not in listed:
+            company = _company('', folder, approval_type, appendix2_choice)
+            company['unlisted'] = True
+            company['warnings'].append(f'manifest に記載が無いため処理しませんでした: {folder}')
+            companies.append(company)
+    return companies
+
+
+def _company(company_name, folder, approval_type, appendix2_choice):
+    return {
+        'company_name': company_name,
+        'folder': folder,
+        'approval_type': approval_type,
+        'appendix2_choice': appendix2_choice,
+        'files': {},
+        'errors': [],
+        'warnings': [],
+        'unlisted': False,
+    }
+
+
+def _entries(directory):
+    """会社フォルダ候補の一覧（隠しファイル・__MACOSX・manifest.csv を除く）。"""
+    return [e for e in os.listdir(directory)
+            if not e.startswith(('.', '__MACOSX')) and e != MANIFEST_NAME]
+
+
+def company_status(company, results):
+    """一覧に載せる会社ごとの結果。未処理（フォルダ・書類が無い）と対象外（manifest に無い）は区別する。"""
+    if company['unlisted']:
+        return '対象外'
+    if not company['files']:
+        return '未処理'
+    return 'エラーあり' if results['errors'] else 'OK'
+
+
+def company_key(index):
+    """会社（manifest の行）ごとの識別子。同じフォルダを複数行で指定しても区別できるよう行番号で付ける。"""
+    return f'company_{index:03d}'
+
+
+def load_manifest(path):
+    """manifest.csv を読み込む（Excelで保存したBOM付きUTF-8にも対応）。"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return [row for row in csv.DictReader(f) if any((v or '').strip() for v in row.values())]
+
+
+def _process_company(company, work_dir, appendix2_dir):
+    """1社分の書類を処理する（プロセスプール内で実行）。PDF変換は呼び出し側で行う。"""
+    output_dir = os.path.join(work_dir, 'output')
+    backup_dir = os.path.join(work_dir, 'backup')
+    os.makedirs(output_dir)
+    os.makedirs(backup_dir)
+    results = _initial_results(company)
+
+    uploaded_docs = {}
+    for key in FILE_TYPES:
+        src = company['files'].get(key)
+        if src:
+            uploaded_docs[key] = stage_document(
+                key, os.path.basename(src), lambda path, src=src: link_or_copy(src, path),
+                work_dir, backup_dir, results['timings'])
+        else:
+            results['warnings'].append(f'{FILE_TYPES[key]["label"]} がスキップされました（未アップロード）。')
+
+    if uploaded_docs:
+        process_documents(uploaded_docs, output_dir, company['company_name'],
+                          company['approval_type'], company['appendix2_choice'],
+                          appendix2_dir, results, parallel=False)
+    return results
+
+
+def _initial_results(company):
+    return {'processed': [], 'errors': list(company['errors']), 'warnings': list(company['warnings']),
+            'timings': []}
+
+
+def run_batch(companies, work_dir, appendix2_dir=DEFAULT_APPENDIX2_DIR,
+              workers=BATCH_WORKERS, progress=None):
+    """全社を処理し、ZIPに入れる (ファイルパス, 格納名) の一覧と各社の結果を返す。
+
+    progress(company_key(i), state) で会社ごとに 'processed' / 'converted' / 'failed' を通知する
+    （i は companies 内の位置）。書類が1通も無い会社は処理せず 'failed'、manifest に記載の無い会社は 'skipped'。
+    """
+    progress = progress or (lambda key, state: None)
+    summaries = [None] * len(companies)
+    company_dirs = [os.path.join(work_dir, company_key(i)) for i in range(len(companies))]
+    conversions = []
+
+    # spawn: スレッドを持つ gunicorn ワーカーからでも安全に子プロセスを作る
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx) as processes, \
+            ThreadPoolExecutor(max_workers=max(1, PDF_CONVERT_WORKERS)) as converters:
+        futures = []
+        for i, company in enumerate(companies):
+            if not company['files']:
+                summaries[i] = (company, _initial_results(company))
+                progress(company_key(i), 'skipped' if company['unlisted'] else 'failed')
+                continue
+            os.makedirs(company_dirs[i])
+            futures.append((i, company, processes.submit(_process_company, company,
+                                                         company_dirs[i], appendix2_dir)))
+
+        for i, company, future in futures:
+            try:
+                results = future.result()
+            except Exception as e:
+                logger.error(f"Batch processing failed for {company['company_name']}: {e}")
+                results = _initial_results(company)
+                results['errors'].append(f'処理中にエラーが発生しました: {e}')
+                summaries[i] = (company, results)
+                progress(company_key(i), 'failed')
+                continue
+            summaries[i] = (company, results)
+            progress(company_key(i), 'processed')
+            # 処理が終わった会社から順に、共有の変換プールでPDF化する
+            output_dir = os.path.join(company_dirs[i], 'output')
+            conversions.append((i, converters.submit(convert_outputs, output_dir, results)))
+
+        for i, future in conversions:
+            try:
+                future.result()
+                progress(company_key(i), 'converted')
+            except Exception as e:
+                summaries[i][1]['errors'].append(f'PDF変換中にエラーが発生しました: {e}')
+                progress(company_key(i), 'failed')
+
+    members = []
+    used_prefixes = set()
+    for i, company in enumerate(companies):
+        output_dir = os.path.join(company_dirs[i], 'output')
+        if not os.path.isdir(output_dir):
+            continue
+        prefix = _unique_prefix(company['company_name'] or company['folder'], used_prefixes)
+        members.extend(package_members(output_dir, os.path.join(company_dirs[i], 'backup'),
+                                       prefix=prefix))
+
+    summary_path = os.path.join(work_dir, SUMMARY_NAME)
+    write_summary(summary_path, summaries)
+    members.append((summary_path, SUMMARY_NAME))
+    return members, summaries
+
+
+def _unique_prefix(name, used):
+    base = name.replace('/', '_').replace('\\', '_')
+    prefix, n = base, 2
+    while prefix in used:
+        prefix = f'{base}_{n}'
+        n += 1
+    used.add(prefix)
+    return prefix + '/'
+
+
+def write_summary(path, summaries):
+    """会社ごとのエラー・警告一覧をCSV（Excelで開けるBOM付きUTF-8）で書き出す。"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['会社名', 'フォルダ', '結果', '成果物数', 'エラー件数', '警告件数', 'エラー', '警告'])
+        for company, results in summaries:
+            writer.writerow([
+                company['company_name'], company['folder'], company_status(company, results),
+                len([p for p in results['processed'] if p]),
+                len(results['errors']), len(results['warnings']),
+                '\n'.join(results['errors']), '\n'.join(results['warnings']),
+            ])
+
+
+def prepare_input(source, work_dir):
+    """入力（ディレクトリ・ZIP・manifest CSV）から (会社フォルダのあるディレクトリ, manifest のパス) を返す。
+
+    manifest のパスは CSV を直接指定したときだけ返し、それ以外は None（ディレクトリ内の manifest.csv を使う）。
+    CSV の会社フォルダは CSV と同じ場所から探す（コピーはしない）。
+    """
+    if os.path.isdir(source):
+        return source, None
+    if zipfile.is_zipfile(source):
+        dest = os.path.join(work_dir, 'input')
+        os.makedirs(dest)
+        extract_archive(source, dest)
+        return dest, None
+    if source.lower().endswith('.csv'):
+        return os.path.dirname(os.path.abspath(source)), os.path.abspath(source)
+    raise ValueError(f'入力はディレクトリ・ZIP・CSVのいずれかを指定してください: {source}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='複数社の書類一式をまとめて処理する')
+    parser.add_argument('source', help='会社フォルダを含むディレクトリ、ZIP、または manifest.csv')
+    parser.add_argument('-o', '--output', required=True, help='出力ZIPのパス')
+    parser.add_argument('--approval-type', default='paper', choices=['paper', 'electronic'],
+                        help='manifest に指定が無い会社の決裁種別')
+    parser.add_argument('--appendix2', default='', help='manifest に指定が無い会社の別紙2差し替えファイル')
+    parser.add_argument('--appendix2-dir', default=DEFAULT_APPENDIX2_DIR)
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    work_dir = tempfile.mkdtemp()
+    try:
+        root, manifest_path = prepare_input(args.source, work_dir)
+        companies = discover_companies(root, args.approval_type, args.appendix2, manifest_path)
+        if not companies:
+            print('処理対象の会社フォルダが見つかりません。', file=sys.stderr)
+            return 1
+        members, summaries = run_batch(companies, work_dir, args.appendix2_dir, args.workers)
+        with open(args.output, 'wb') as f:
+            write_zip(f, members)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    unprocessed = 0
+    for company, results in summaries:
+        status = company_status(company, results)
+        unprocessed += status == '未処理'
+        print(f"{company['company_name'] or company['folder']}: {status} "
+              f"(エラー {len(results['errors'])} 件 / 警告 {len(results['warnings'])} 件)")
+    print(f'出力: {args.output}')
+    if unprocessed:
+        print(f'{unprocessed} 社は書類を処理できませんでした。', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
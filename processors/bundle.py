@@ -0,0 +1,146 @@
+"""結合PDF — 1社分の書類一式を FILE_TYPES の順に1つのPDFにまとめる（書類ごとのしおり付き）
+
+承認システムへは書類5通のZIPではなく1社1つのPDFで渡すため、PDF変換後の成果物を結合する。
+元からPDFの書類（チェックシートなど）は再変換せずそのまま結合する。
+
+qpdf が見つかれば qpdf で結合する（全ページをメモリに載せずに書き出せる）。しおりは結合後のPDFに
+qpdf の JSON 更新（--update-from-json）で追加する。qpdf が無い・失敗した場合は pypdf で結合する
+（pypdf は書き出すまで全ページを保持するので、書類が大きいとメモリを使う）。
+"""
+import json
+import logging
+import os
+import subprocess
+
+from pypdf import PdfReader, PdfWriter
+
+from .catalog import FILE_TYPES
+from .metrics import timed
+from .pdf_optimize import QPDF_TIMEOUT, _find_qpdf
+
+logger = logging.getLogger(__name__)
+
+
+def build_bundle(bundle_path, documents, results):
+    """process_package の戻り値（documents）から結合PDFを bundle_path に書き出し、'bundle' 工程として記録する。
+
+    結合できる書類が1通も無ければ RuntimeError。
+    """
+    entries = bundle_entries(documents, results)
+    if not entries:
+        raise RuntimeError('結合PDFに含められる書類がありません')
+    with timed(results['timings'], 'bundle', path=bundle_path) as entry:
+        qpdf = _find_qpdf()
+        if qpdf:
+            try:
+                entry['pages'] = write_bundle_qpdf(qpdf, bundle_path, entries)
+                entry['engine'] = 'qpdf'
+                return
+            except (OSError, ValueError, KeyError, subprocess.SubprocessError) as e:
+                logger.warning(f'qpdf bundling failed, falling back to pypdf: {e}')
+        with open(bundle_path, 'wb') as f:
+            entry['pages'] = write_bundle(f, entries)
+        entry['engine'] = 'pypdf'
+
+
+
+def bundle_entries(documents, results):
+    """process_package の戻り値から、結合する (しおりの見出し, PDFパス) を FILE_TYPES の順に並べる。
+
+    PDFにできなかった書類（整形・PDF変換の失敗）は警告に積んで除く。
+    """
+    entries = []
+    for key in FILE_TYPES:
+        if key not in documents:
+            continue
+        if not documents[key]:
+            results['warnings'].append(
+                f'{FILE_TYPES[key]["label"]} はPDFにできなかったため結合PDFに含めていません。')
+            continue
+        for path in documents[key]:
+            entries.append((os.path.splitext(os.path.basename(path))[0], path))
+    return entries
+
+
+def write_bundle(fileobj, entries):
+    """entries の (しおりの見出し, PDFパス) を順に結合して fileobj に書き出す。戻り値はページ数。"""
+    writer = PdfWriter()
+    for title, path in entries:
+        with open(path, 'rb') as f:
+            writer.append(PdfReader(f), outline_item=title)
+    # 開いたときにしおりを表示する
+    writer.page_mode = '/UseOutlines'
+    writer.write(fileobj)
+    return len(writer.pages)
+
+
+def write_bundle_qpdf(qpdf, bundle_path, entries):
+    """entries を qpdf で結合し、しおりを付けて bundle_path に書き出す。戻り値はページ数。
+
+    qpdf の終了コード 3 は警告のみ（出力は有効）。それ以外は subprocess.CalledProcessError。
+    """
+    merged = bundle_path + '.merged'
+    update = bundle_path + '.outline.json'
+    try:
+        _run_qpdf(qpdf, '--empty', '--pages', *(path for _, path in entries), '--', merged)
+        info = json.loads(_run_qpdf(qpdf, '--json=2', '--json-key=qpdf', '--json-key=pages',
+                                    '--json-object=trailer', merged))
+        header, objects = info['qpdf']
+        pages = [page['object'] for page in info['pages']]
+        root_ref = objects['trailer']['value']['/Root']
+        root_id = ','.join(root_ref.split()[:2])
+        root = json.loads(_run_qpdf(qpdf, '--json=2', '--json-key=qpdf', f'--json-object={root_id}',
+                                    merged))['qpdf'][1][f'obj:{root_ref}']['value']
+
+        outline = _outline_objects(entries, pages, root_ref, root, header['maxobjectid'])
+        with open(update, 'w', encoding='utf-8') as f:
+            json.dump({'qpdf': [{'jsonversion': 2, 'pushedinheritedpageresources': False,
+                                 'calledgetallpages': False, 'maxobjectid': header['maxobjectid']},
+                                outline]}, f, ensure_ascii=False)
+        _run_qpdf(qpdf, merged, f'--update-from-json={update}', bundle_path)
+        return len(pages)
+    finally:
+        for tmp in (merged, update):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def _outline_objects(entries, pages, root_ref, root, max_object_id):
+    """書類ごとのしおり（先頭ページへのリンク）を qpdf JSON のオブジェクトとして組み立てる。
+
+    新しいオブジェクトには max_object_id より後の番号を振る。カタログ（root）には
+    しおりと、開いたときにしおりを表示する指定を追加する。
+    """
+    outlines_ref = f'{max_object_id + 1} 0 R'
+    items, start = [], 0
+    for title, path in entries:
+        with open(path, 'rb') as f:
+            count = len(PdfReader(f).pages)
+        if count:
+            items.append((title, pages[start]))
+        start += count
+    refs = [f'{max_object_id + 2 + i} 0 R' for i in range(len(items))]
+    if not refs:
+        return {}
+
+    objects = {
+        f'obj:{root_ref}': {'value': dict(root, **{'/Outlines': outlines_ref, '/PageMode': '/UseOutlines'})},
+        f'obj:{outlines_ref}': {'value': {'/Type': '/Outlines', '/First': refs[0], '/Last': refs[-1],
+                                          '/Count': len(refs)}},
+    }
+    for i, ((title, page), ref) in enumerate(zip(items, refs)):
+        item = {'/Title': 'u:' + title, '/Parent': outlines_ref, '/Dest': [page, '/Fit']}
+        if i > 0:
+            item['/Prev'] = refs[i - 1]
+        if i + 1 < len(refs):
+            item['/Next'] = refs[i + 1]
+        objects[f'obj:{ref}'] = {'value': item}
+    return objects
+
+
+def _run_qpdf(qpdf, *args):
+    """qpdf を実行して標準出力を返す。"""
+    proc = subprocess.run([qpdf, *args], capture_output=True, text=True, timeout=QPDF_TIMEOUT)
+    if proc.returncode not in (0, 3):
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, proc.stdout, proc.stderr)
+    return proc.stdout
@@ -0,0 +1,34 @@
+"""書類の種類と別紙2候補の一覧 — トップページ表示用の軽量モジュール
+
+python-docx・openpyxl などの重いライブラリを読み込まないので、
+起動直後（重いモジュールの読み込み中）でも / を返せる。
+"""
+import os
+import threading
+
+FILE_TYPES = {
+    'contract': {'label': '① 契約書', 'naming': '基本契約書_{company}'},
+    'estimate': {'label': '② 見積書', 'naming': '別紙１_{company}'},
+    'oath': {'label': '③ 誓約書', 'naming': '誓約書_{company}'},
+    'checklist': {'label': '④ チェックシート', 'naming': '持続可能性の確保に向けた取組状況について（チェックシート）_{company}'},
+    'confirmation': {'label': '⑤ 確認書', 'naming': '電子契約サービス利用確認書_{company}'},
+}
+
+_appendix2_listing = {}
+_listing_lock = threading.Lock()
+
+
+def list_appendix2_files(appendix2_dir):
+    """差し替え候補の別紙2ファイル名一覧。ディレクトリの更新日時が変わるまで再利用する。"""
+    if not os.path.isdir(appendix2_dir):
+        return []
+    mtime = os.path.getmtime(appendix2_dir)
+    with _listing_lock:
+        cached = _appendix2_listing.get(appendix2_dir)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    files = [f for f in os.listdir(appendix2_dir)
+             if f.endswith(('.docx', '.xlsx', '.pdf'))]
+    with _listing_lock:
+        _appendix2_listing[appendix2_dir] = (mtime, files)
+    return files
@@ -1,13 +1,147 @@
 """共通処理: 書式クリーニング・エンティティ抽出・突合チェック"""
+import os
 import re
-from docx import Document
+import shutil
+import unicodedata
+import zipfile
 from docx.shared import Pt, RGBColor
 from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
 
+from .docx_io import LazyDocument
 
-def clean_formatting(doc: Document) -> Document:
-    """網掛け・太字・コメント解除、黒字標準スタイルに統一する。"""
-    for para in doc.paragraphs:
+
+class ParagraphIndex:
+    """doc.paragraphs を1回だけ走査して作る段落索引。
+
+    python-docx は doc.paragraphs にアクセスするたびに Paragraph を作り直し、
+    p.text もランを連結し直すため、段落・テキスト・ルール該当位置を保持しておく。
+    rules（rules.RuleSet）で各段落を1回ずつ照合し、hits[i] に {ルール名: パターン番号} を、
+    marks[ルール名][i] に該当有無を記録する。段落の削除・挿入時は索引も差分更新する。
+    """
+
+    def __init__(self, doc: LazyDocument, rules=None):
+        self.doc = doc
+        self.rules = rules
+        self.paragraphs = list(doc.paragraphs) if doc is not None else []
+        self.texts = [p.text for p in self.paragraphs]
+        self._mark_all()
+
+    @classmethod
+    def from_texts(cls, texts, rules=None):
+        """段落テキストだけから作る読み取り専用の索引（チェック専用、変更操作は不可）。"""
+        index = cls(None, rules)
+        index.texts = list(texts)
+        index._mark_all()
+        return index
+
+    def _mark_all(self):
+        self.hits = [self._scan(t) for t in self.texts]
+        names = self.rules.names if self.rules else []
+        self.marks = {name: [name in h for h in self.hits] for name in names}
+
+    def _scan(self, text):
+        return self.rules.scan(text) if self.rules else {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def full_text(self) -> str:
+        return '\n'.join(self.texts)
+
+    def positions(self, name) -> list:
+        """マーカー name に該当する段落番号の一覧。"""
+        return [i for i, hit in enumerate(self.marks[name]) if hit]
+
+    def first(self, name, start=0):
+        """start 以降で最初にマーカー name に該当する段落番号。無ければ None。"""
+        marks = self.marks[name]
+        for i in range(start, len(marks)):
+            if marks[i]:
+                return i
+        return None
+
+    def clear(self, i):
+        """段落 i の内容を空にする（段落自体は残す）。"""
+        self.paragraphs[i].clear()
+        self._set(i, self.paragraphs[i], '')
+
+    def remove(self, indices):
+        """指定番号の段落を文書と索引から削除する。"""
+        for i in sorted(set(indices), reverse=True):
+            p = self.paragraphs[i]._element
+            p.getparent().remove(p)
+            del self.paragraphs[i]
+            del self.texts[i]
+            del self.hits[i]
+            for marks in self.marks.values():
+                del marks[i]
+
+    def insert_after(self, i, elements):
+        """段落 i の後ろに w:p 要素を順に挿入し、索引にも追加する。"""
+        anchor = self.paragraphs[i]
+        insert_after = anchor._element
+        for offset, el in enumerate(elements, start=1):
+            insert_after.addnext(el)
+            insert_after = el
+            para = Paragraph(el, anchor._parent)
+            self.paragraphs.insert(i + offset, para)
+            self.texts.insert(i + offset, '')
+            self.hits.insert(i + offset, {})
+            for marks in self.marks.values():
+                marks.insert(i + offset, False)
+            self._set(i + offset, para, para.text)
+
+    def _set(self, i, para, text):
+        self.paragraphs[i] = para
+        self.texts[i] = text
+        self.hits[i] = self._scan(text)
+        for name, marks in self.marks.items():
+            marks[i] = name in self.hits[i]
+
+
+# 書式クリーニングの実装: 'xml'（lxmlで一括書き換え）または 'reference'（python-docx API、比較用）
+CLEAN_FORMATTING_MODE = os.environ.get('CLEAN_FORMATTING_MODE', 'xml')
+
+W_R = qn('w:r')
+W_RPR = qn('w:rPr')
+W_VAL = qn('w:val')
+W_SHD = qn('w:shd')
+W_HIGHLIGHT = qn('w:highlight')
+# w:rPr の子要素の並び順（スキーマ定義順）。要素を追加するときはこの順を守る
+RPR_CHILD_ORDER = [qn(f'w:{t}') for t in (
+    'rStyle', 'rFonts', 'b', 'bCs', 'i', 'iCs', 'caps', 'smallCaps', 'strike', 'dstrike',
+    'outline', 'shadow', 'emboss', 'imprint', 'noProof', 'snapToGrid', 'vanish', 'webHidden',
+    'color', 'spacing', 'w', 'kern', 'position', 'sz', 'szCs', 'highlight', 'u', 'effect',
+    'bdr', 'shd', 'fitText', 'vertAlign', 'rtl', 'cs', 'em', 'lang', 'eastAsianLayout',
+    'specVanish', 'oMath')]
+_RPR_RANK = {tag: i for i, tag in enumerate(RPR_CHILD_ORDER)}
+W_B, W_COLOR = qn('w:b'), qn('w:color')
+_COLOR_THEME_ATTRS = [qn(f'w:{a}') for a in ('themeColor', 'themeTint', 'themeShade')]
+
+
+def clean_formatting(doc: LazyDocument, index: ParagraphIndex = None, mode: str = None) -> LazyDocument:
+    """網掛け・太字・コメント解除、黒字標準スタイルに統一する。
+
+    mode='xml'（既定）は本文・表・ヘッダー・フッターの全ランを lxml で1パスで書き換える。
+    mode='reference' は従来の python-docx API による実装（本文直下の段落のみ）。
+    """
+    mode = mode or CLEAN_FORMATTING_MODE
+    if mode == 'reference':
+        _clean_formatting_reference(doc, index)
+    else:
+        for root in _formatting_roots(doc):
+            clean_runs_xml(root)
+
+    # コメント削除
+    _remove_comments(doc)
+    return doc
+
+
+def _clean_formatting_reference(doc, index=None):
+    paragraphs = index.paragraphs if index is not None else doc.paragraphs
+    for para in paragraphs:
         for run in para.runs:
             # 太字解除
             run.bold = False
@@ -22,12 +156,49 @@ def clean_formatting(doc: Document) -> Document:
                 if shd is not None:
                     rpr.remove(shd)
 
-    # コメント削除
-    _remove_comments(doc)
-    return doc
+
+def _formatting_roots(doc):
+    """書式クリーニング対象のXMLルート: 本文と、全ヘッダー・フッター。"""
+    yield doc.element.body
+    yield from doc.xml_parts(('word/header', 'word/footer'))
+
+
+def clean_runs_xml(root):
+    """root 配下の全 w:r の w:rPr を書き換える: 太字解除・黒字・網掛け/ハイライト削除。
+
+    太字は w:b を消すだけだとスタイル側の太字が残るため、参照実装と同じく w:val="0" にする。
+    """
+    for r in root.iter(W_R):
+        rpr = r.find(W_RPR)
+        if rpr is None:
+            rpr = r.makeelement(W_RPR, {})
+            r.insert(0, rpr)
+        for child in list(rpr):
+            if child.tag in (W_SHD, W_HIGHLIGHT):
+                rpr.remove(child)
+        _set_rpr_child(rpr, W_B).set(W_VAL, '0')
+        color = _set_rpr_child(rpr, W_COLOR)
+        color.set(W_VAL, '000000')
+        for attr in _COLOR_THEME_ATTRS:
+            color.attrib.pop(attr, None)
+
+
+def _set_rpr_child(rpr, tag):
+    """rPr の子要素 tag を返す。無ければスキーマ順を守って追加する。"""
+    el = rpr.find(tag)
+    if el is not None:
+        return el
+    el = rpr.makeelement(tag, {})
+    rank = _RPR_RANK[tag]
+    for i, child in enumerate(rpr):
+        if _RPR_RANK.get(child.tag, -1) > rank:
+            rpr.insert(i, el)
+            return el
+    rpr.append(el)
+    return el
 
 
-def _remove_comments(doc: Document):
+def _remove_comments(doc: LazyDocument):
     """Word文書からコメントを削除する。"""
     body = doc.element.body
     # コメント参照を削除
@@ -35,48 +206,74 @@ def _remove_comments(doc: Document):
         for el in body.iter(qn(tag)):
             el.getparent().remove(el)
     # コメントパーツ自体を削除
-    comments_part_name = '/word/comments.xml'
-    if hasattr(doc.part, 'package'):
-        try:
-            parts = doc.part.package.parts
-            to_remove = [p for p in parts if hasattr(p, 'partname')
-                         and str(p.partname) == comments_part_name]
-            for p in to_remove:
-                parts.pop(p.partname)
-        except Exception:
-            pass
-
-
-def extract_entity_info(doc: Document) -> dict:
+    doc.remove_comments()
+
+
+def extract_entity_info(doc: LazyDocument, index: ParagraphIndex = None) -> dict:
     """文書から法人名・住所・役職者名・代表者名を抽出する。"""
-    text = '\n'.join(p.text for p in doc.paragraphs)
+    if index is not None:
+        text = index.full_text
+    else:
+        text = '\n'.join(p.text for p in doc.paragraphs)
+    return extract_entity_info_from_text(text)
+
+
+# 抽出する項目と、その値を拾う正規表現（最初に一致したものを採用）
+ENTITY_PATTERNS = {
+    # 法人名: 「乙」の後に続く法人名を探す
+    'company': re.compile(r'乙\s*[：:]\s*(.+)'),
+    # 住所
+    'address': re.compile(r'(?:住所|所在地)\s*[：:]\s*(.+)'),
+    # 代表者名
+    'representative': re.compile(r'代表(?:取締役|者)\s*(.+)'),
+}
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def extract_entity_info_from_text(text: str) -> dict:
+    """テキストから法人名・住所・役職者名・代表者名を抽出する。"""
     info = {
         'company': '',
         'address': '',
         'title': '',
         'representative': '',
     }
+    for key, pattern in ENTITY_PATTERNS.items():
+        m = pattern.search(text)
+        if m:
+            info[key] = m.group(1).strip()
 
-    # 法人名: 「乙」の後に続く法人名を探す
-    m = re.search(r'乙\s*[：:]\s*(.+)', text)
-    if m:
-        info['company'] = m.group(1).strip()
+    return info
 
-    # 住所
-    m = re.search(r'(?:住所|所在地)\s*[：:]\s*(.+)', text)
-    if m:
-        info['address'] = m.group(1).strip()
 
-    # 代表者名
-    m = re.search(r'代表(?:取締役|者)\s*(.+)', text)
-    if m:
-        info['representative'] = m.group(1).strip()
+def extract_entity_info_from_lines(lines) -> dict:
+    """行の反復から法人情報を抽出する。全項目が見つかった時点で読むのをやめる。
 
+    lines は遅延評価のイテレータでよい（Excelの行・PDFのページを順に読む場合など）。
+    """
+    info = extract_entity_info_from_text('')
+    remaining = dict(ENTITY_PATTERNS)
+    for line in lines:
+        for key, pattern in list(remaining.items()):
+            m = pattern.search(line)
+            if m:
+                info[key] = m.group(1).strip()
+                del remaining[key]
+        if not remaining:
+            break
     return info
 
 
+def normalize_entity_value(value: str) -> str:
+    """突合用に正規化する: NFKC（全角英数・記号を半角に）と空白の除去。
+
+    PDFから取り出したテキストは文字間の空白・改行が不定なので、空白の有無は区別しない。
+    """
+    return _WHITESPACE_RE.sub('', unicodedata.normalize('NFKC', value or ''))
+
+
 def cross_check_entities(entity_infos: dict) -> list:
-    """複数書類間で法人情報が一致しているか突合する。"""
+    """複数書類間で法人情報が一致しているか突合する（normalize_entity_value で正規化して比較）。"""
     errors = []
     keys_to_check = ['company', 'address', 'representative']
     labels = {'company': '法人名', 'address': '住所', 'representative': '代表者名'}
@@ -93,10 +290,32 @@ def cross_check_entities(entity_infos: dict) -> list:
         for key in keys_to_check:
             base_val = base_info.get(key, '').strip()
             cur_val = info.get(key, '').strip()
-            if base_val and cur_val and base_val != cur_val:
+            if (base_val and cur_val
+                    and normalize_entity_value(base_val) != normalize_entity_value(cur_val)):
                 errors.append(
                     f'【整合性エラー】{labels[key]}が不一致: '
                     f'{base_doc}「{base_val}」≠ {doc_name}「{cur_val}」'
                 )
 
     return errors
+
+
+def link_or_copy(src, dst):
+    """src を dst にハードリンクする。リンクできない場合（別ボリューム・FAT等）はコピーする。
+
+    アップロードの保存は1回だけにし、バックアップやPDFの素通し出力は同じ実体を参照させる。
+    処理はいずれも別ファイルに書き出すため、入力ファイルが書き換えられることはない。
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def is_xlsx(filepath):
+    """Excelブック（xl/workbook.xml を含むZIP）かどうかを、ブックを読み込まずに判定する。"""
+    try:
+        with zipfile.ZipFile(filepath) as zf:
+            return 'xl/workbook.xml' in zf.namelist()
+    except (zipfile.BadZipFile, OSError):
+        return False
@@ -1,30 +1,48 @@
 """⑤ 確認書の処理"""
 import os
-from docx import Document
-from openpyxl import load_workbook
 
-from .common import clean_formatting, extract_entity_info
+from .common import clean_formatting, extract_entity_info, is_xlsx, link_or_copy
+from .docx_io import open_docx
+from .extractors import extract_entity_info_from_pdf, extract_entity_info_from_xlsx
+from .metrics import timed
 
 
 def process_confirmation(filepath, output_dir, company_name):
-    result = {'output_name': '', 'errors': [], 'warnings': [], 'entity_info': None}
+    result = {'output_name': '', 'errors': [], 'warnings': [], 'entity_info': None, 'timings': []}
+    timings = result['timings']
     output_name = f'電子契約サービス利用確認書_{company_name}'
     ext = os.path.splitext(filepath)[1].lower()
 
     if ext == '.docx':
-        doc = Document(filepath)
-        clean_formatting(doc)
-        result['entity_info'] = extract_entity_info(doc)
+        with timed(timings, 'load') as entry:
+            entry['bytes'] = os.path.getsize(filepath)
+            doc = open_docx(filepath)
+        with timed(timings, 'clean_formatting'):
+            clean_formatting(doc)
+        with timed(timings, 'extract_entity_info'):
+            result['entity_info'] = extract_entity_info(doc)
         output_name += '.docx'
-        doc.save(os.path.join(output_dir, output_name))
+        output_path = os.path.join(output_dir, output_name)
+        with timed(timings, 'save', path=output_path):
+            doc.save(output_path)
     elif ext == '.xlsx':
-        wb = load_workbook(filepath)
+        # 内容は変更しないため、openpyxl で読み込み・保存し直さずそのまま出力する
+        if not is_xlsx(filepath):
+            result['errors'].append('確認書: Excelファイルとして読み込めません')
+            return result
         output_name += '.xlsx'
-        wb.save(os.path.join(output_dir, output_name))
+        output_path = os.path.join(output_dir, output_name)
+        with timed(timings, 'passthrough', path=output_path):
+            link_or_copy(filepath, output_path)
+        with timed(timings, 'extract_entity_info'):
+            result['entity_info'] = extract_entity_info_from_xlsx(filepath)
     elif ext == '.pdf':
-        import shutil
         output_name += '.pdf'
-        shutil.copy2(filepath, os.path.join(output_dir, output_name))
+        output_path = os.path.join(output_dir, output_name)
+        with timed(timings, 'passthrough', path=output_path):
+            link_or_copy(filepath, output_path)
+        with timed(timings, 'extract_entity_info'):
+            result['entity_info'] = extract_entity_info_from_pdf(filepath)
     else:
         result['errors'].append(f'確認書: 未対応のファイル形式です ({ext})')
         return result
@@ -1,38 +1,34 @@
 """① 契約書（基本契約書）の処理"""
+import copy
 import os
-import re
-import shutil
-from docx import Document
+import threading
 
-from .common import clean_formatting, extract_entity_info
+from .common import ParagraphIndex, clean_formatting, extract_entity_info, link_or_copy
+from .docx_io import open_docx
+from .extractors import extract_entity_info_from_pdf
+from .metrics import timed
+from .rules import RULES
 
 
-SEAL_CLAUSE = '本契約の成立を証するため、本書２通を作成し、甲乙署名又は記名捺印の上、各１通を保有するものとする。'
-PARTNER_PAGE_KEYWORDS = ['カテゴリー及びパートナー', 'カテゴリー・パートナー']
-APPENDIX2_KEYWORDS = ['別紙2', '別紙２']
-APPENDIX3_KEYWORDS = ['別紙3', '別紙３']
-
-# 別紙2の最新様式を識別するためのキーワード（最新版に含まれる文言）
-APPENDIX2_LATEST_KEYWORDS = [
-    '愛知・名古屋2026',  # 最新の大会名
-    '2026アジア・アジアパラ競技大会',
-]
-# 旧様式を示すキーワード（これが含まれていたら古い）
-APPENDIX2_OLD_KEYWORDS = [
-    '第20回アジア競技大会',
-    '2026年アジア競技大会',
-]
+# 別紙2差し替え用テンプレートのプロセス内キャッシュ（ファイル更新日時で無効化）
+_appendix2_cache = {}
+_appendix2_lock = threading.Lock()
 
 
 def process_contract(filepath, output_dir, company_name, approval_type,
                      appendix2_choice, appendix2_dir):
-    result = {'output_name': '', 'errors': [], 'warnings': [], 'entity_info': None}
+    result = {'output_name': '', 'errors': [], 'warnings': [], 'entity_info': None, 'timings': []}
+    timings = result['timings']
     ext = os.path.splitext(filepath)[1].lower()
 
     # PDF入力の場合はバリデーションなしでコピーのみ
     if ext == '.pdf':
         output_name = f'基本契約書_{company_name}.pdf'
-        shutil.copy2(filepath, os.path.join(output_dir, output_name))
+        output_path = os.path.join(output_dir, output_name)
+        with timed(timings, 'passthrough', path=output_path):
+            link_or_copy(filepath, output_path)
+        with timed(timings, 'extract_entity_info'):
+            result['entity_info'] = extract_entity_info_from_pdf(filepath)
         result['output_name'] = output_name
         result['warnings'].append('契約書がPDF形式のため、内容チェック・整形処理はスキップされました。')
         return result
@@ -42,138 +38,141 @@ def process_contract(filepath, output_dir, company_name, approval_type,
         return result
 
     output_name = f'基本契約書_{company_name}.docx'
-    doc = Document(filepath)
-    full_text = '\n'.join(p.text for p in doc.paragraphs)
+    with timed(timings, 'load') as entry:
+        entry['bytes'] = os.path.getsize(filepath)
+        doc = open_docx(filepath)
+        index = ParagraphIndex(doc, RULES)
 
     # --- 決裁種別チェック ---
     if approval_type == 'paper':
-        _check_date_fields(doc, result)
-        _check_seal_clause_exists(full_text, result)
+        with timed(timings, 'check_date_fields'):
+            _check_date_fields(index, result)
+        with timed(timings, 'check_seal_clause'):
+            _check_seal_clause_exists(index, result)
     elif approval_type == 'electronic':
-        _remove_seal_clause(doc)
+        with timed(timings, 'remove_seal_clause'):
+            _remove_seal_clause(index)
 
     # --- 別紙2の様式チェック ---
-    _check_appendix2_version(doc, result)
+    with timed(timings, 'check_appendix2_version'):
+        _check_appendix2_version(index, result)
 
     # --- カテゴリー及びパートナー ページ削除 ---
-    _remove_partner_pages(doc, result)
+    with timed(timings, 'remove_partner_pages'):
+        _remove_partner_pages(index, result)
 
     # --- 別紙2差し替え ---
     if appendix2_choice:
-        _replace_appendix2(doc, appendix2_choice, appendix2_dir, result)
+        with timed(timings, 'replace_appendix2'):
+            _replace_appendix2(index, appendix2_choice, appendix2_dir, result)
 
     # --- 書式クリーニング ---
-    clean_formatting(doc)
+    with timed(timings, 'clean_formatting'):
+        clean_formatting(doc, index)
 
     # --- エンティティ抽出 ---
-    result['entity_info'] = extract_entity_info(doc)
+    with timed(timings, 'extract_entity_info'):
+        result['entity_info'] = extract_entity_info(doc, index)
 
     # --- 保存 ---
     output_path = os.path.join(output_dir, output_name)
-    doc.save(output_path)
+    with timed(timings, 'save', path=output_path):
+        doc.save(output_path)
     result['output_name'] = output_name
     return result
 
 
-def _check_date_fields(doc, result):
+def _check_date_fields(index, result):
     """紙決裁: 年月日欄に具体的な月日が記入されていないかチェック。"""
-    for para in doc.paragraphs:
-        text = para.text.strip()
-        # 「年月日」「年 月 日」パターンを探す
-        if re.search(r'年.*月.*日', text):
-            # 具体的な月日が入っている場合（例: 2026年4月1日）
-            if re.search(r'\d{1,2}\s*月\s*\d{1,2}\s*日', text):
-                result['errors'].append(
-                    f'【契約書エラー】日付欄に具体的な月日が記入されています: 「{text}」'
-                )
-
-
-def _check_seal_clause_exists(full_text, result):
-    """紙決裁: 署名捺印条項の存在確認。"""
-    if SEAL_CLAUSE not in full_text:
-        # 部分一致でも探す
-        if '本契約の成立を証するため' not in full_text:
+    for i, text in enumerate(index.texts):
+        # 「年月日」「年 月 日」の欄に、具体的な月日が入っている場合（例: 2026年4月1日）
+        if index.marks['date_field'][i] and index.marks['filled_date'][i]:
             result['errors'].append(
-                '【契約書エラー】署名捺印条項「本契約の成立を証するため〜」が見つかりません。'
+                f'【契約書エラー】日付欄に具体的な月日が記入されています: 「{text.strip()}」'
             )
 
 
-def _remove_seal_clause(doc):
+def _check_seal_clause_exists(index, result):
+    """紙決裁: 署名捺印条項の存在確認（条項の書き出しの部分一致）。"""
+    if not any(index.marks['seal']):
+        result['errors'].append(
+            '【契約書エラー】署名捺印条項「本契約の成立を証するため〜」が見つかりません。'
+        )
+
+
+def _remove_seal_clause(index):
     """電子決裁: 署名捺印条項を削除する。"""
-    for para in doc.paragraphs:
-        if '本契約の成立を証するため' in para.text:
-            para.clear()
+    for i in index.positions('seal'):
+        index.clear(i)
 
 
-def _check_appendix2_version(doc, result):
+def _check_appendix2_version(index, result):
     """別紙2が最新様式かどうかチェックする。"""
     in_appendix2 = False
-    appendix2_text = []
-
-    for para in doc.paragraphs:
-        text = para.text.strip()
+    section = []
 
+    for i in range(len(index)):
         # 別紙2セクション開始
-        if any(kw in text for kw in APPENDIX2_KEYWORDS):
+        if index.marks['appendix2'][i]:
             in_appendix2 = True
             continue
 
         # 別紙3に到達したら終了
-        if any(kw in text for kw in APPENDIX3_KEYWORDS):
+        if index.marks['appendix3'][i]:
             break
 
         if in_appendix2:
-            appendix2_text.append(text)
-
-    full_appendix2 = '\n'.join(appendix2_text)
-
-    # 旧様式キーワードが含まれていたらエラー
-    for old_kw in APPENDIX2_OLD_KEYWORDS:
-        if old_kw in full_appendix2:
-            result['errors'].append(
-                f'【別紙2エラー】旧様式の可能性があります。「{old_kw}」が検出されました。'
-                '最新の別紙2に差し替えてください。'
-            )
-            return
+            section.append(i)
+
+    # 旧様式キーワードが含まれていたらエラー（rules.json の並びで最初のもの）
+    old_hits = {n for i in section for n in index.hits[i].get('appendix2_old', [])}
+    if old_hits:
+        old_kw = index.rules.source('appendix2_old', min(old_hits))
+        result['errors'].append(
+            f'【別紙2エラー】旧様式の可能性があります。「{old_kw}」が検出されました。'
+            '最新の別紙2に差し替えてください。'
+        )
+        return
 
     # 最新様式キーワードが含まれているか確認
-    has_latest = any(kw in full_appendix2 for kw in APPENDIX2_LATEST_KEYWORDS)
-    if not has_latest and appendix2_text:
+    has_latest = any(index.marks['appendix2_latest'][i] for i in section)
+    if not has_latest and section:
         result['warnings'].append(
             '【別紙2確認】最新様式のキーワードが見つかりませんでした。'
             '別紙2が最新版であることを確認してください。'
         )
 
 
-def _remove_partner_pages(doc, result):
+def _remove_partner_pages(index, result):
     """カテゴリー及びパートナーのセクションを削除。別紙2・3は保護。"""
-    paragraphs_to_remove = []
-    in_partner_section = False
+    paragraphs_to_remove = _partner_section(index)
+    index.remove(paragraphs_to_remove)
+
+    if paragraphs_to_remove:
+        result['warnings'].append('「カテゴリー及びパートナー」セクションを削除しました。')
 
-    for i, para in enumerate(doc.paragraphs):
-        text = para.text.strip()
 
+def _partner_section(index):
+    """カテゴリー及びパートナーのセクションの段落番号（別紙2・3に到達したら終わる）。"""
+    paragraphs = []
+    in_partner_section = False
+
+    for i in range(len(index)):
         # 別紙2・3に到達したら削除を停止
-        if any(kw in text for kw in APPENDIX2_KEYWORDS + APPENDIX3_KEYWORDS):
+        if index.marks['appendix2'][i] or index.marks['appendix3'][i]:
             in_partner_section = False
             continue
 
         # パートナーセクション開始検出
-        if any(kw in text for kw in PARTNER_PAGE_KEYWORDS):
+        if index.marks['partner'][i]:
             in_partner_section = True
 
         if in_partner_section:
-            paragraphs_to_remove.append(para)
-
-    for para in paragraphs_to_remove:
-        p = para._element
-        p.getparent().remove(p)
-
-    if paragraphs_to_remove:
-        result['warnings'].append('「カテゴリー及びパートナー」セクションを削除しました。')
+            paragraphs.append(i)
+    return paragraphs
 
 
-def _replace_appendix2(doc, appendix2_filename, appendix2_dir, result):
+def _replace_appendix2(index, appendix2_filename, appendix2_dir, result):
     """別紙2を指定ファイルに差し替える。"""
     source_path = os.path.join(appendix2_dir, appendix2_filename)
     if not os.path.exists(source_path):
@@ -181,31 +180,18 @@ def _replace_appendix2(doc, appendix2_filename, appendix2_dir, result):
         return
 
     try:
-        replacement_doc = Document(source_path)
+        template = _load_appendix2(source_path)
         # 別紙2の開始位置を探す
-        start_idx = None
-        end_idx = None
-        for i, para in enumerate(doc.paragraphs):
-            text = para.text.strip()
-            if any(kw in text for kw in APPENDIX2_KEYWORDS) and start_idx is None:
-                start_idx = i
-            elif start_idx is not None and any(kw in text for kw in APPENDIX3_KEYWORDS):
-                end_idx = i
-                break
+        start_idx = index.first('appendix2')
+        end_idx = index.first('appendix3', start_idx + 1) if start_idx is not None else None
 
         if start_idx is not None:
             # 既存の別紙2内容を削除（見出し以降〜別紙3手前まで）
-            paras_to_remove = doc.paragraphs[start_idx + 1:end_idx] if end_idx else doc.paragraphs[start_idx + 1:]
-            for para in paras_to_remove:
-                p = para._element
-                p.getparent().remove(p)
+            stop = end_idx if end_idx else len(index)
+            index.remove(range(start_idx + 1, stop))
 
             # 差し替え内容を挿入
-            insert_after = doc.paragraphs[start_idx]._element
-            for para in replacement_doc.paragraphs:
-                new_p = para._element.__deepcopy__(True)
-                insert_after.addnext(new_p)
-                insert_after = new_p
+            index.insert_after(start_idx, [copy.deepcopy(p) for p in template])
 
             result['warnings'].append(f'別紙2を「{appendix2_filename}」に差し替えました。')
         else:
@@ -213,3 +199,17 @@ def _replace_appendix2(doc, appendix2_filename, appendix2_dir, result):
 
     except Exception as e:
         result['errors'].append(f'別紙2差し替えエラー: {str(e)}')
+
+
+def _load_appendix2(source_path):
+    """別紙2ファイルの段落要素（w:p）を返す。解析結果は更新日時が変わるまで再利用する。"""
+    mtime = os.path.getmtime(source_path)
+    with _appendix2_lock:
+        cached = _appendix2_cache.get(source_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    template = [para._element for para in open_docx(source_path).paragraphs]
+    with _appendix2_lock:
+        _appendix2_cache[source_path] = (mtime, template)
+    return template
+
@@ -0,0 +1,178 @@
+"""docx の遅延読み書き — 書き換える XML パーツだけを解析し、その他は圧縮済みのまま写す
+
+python-docx の Document(path) はパッケージ全体（画像・スタイル・番号定義など）を読み込み、
+save() で全パーツを再シリアライズ・再圧縮する。本処理で書き換えるのは本文（word/document.xml）と
+ヘッダー・フッター、削除するコメントだけなので、open_docx() は本文だけを解析し、
+ヘッダー・フッターは xml_parts() で要求されたときに初めて解析する。
+save() では解析していないパーツを展開・再圧縮せず、圧縮済みのバイト列のまま出力ZIPへコピーする。
+"""
+import posixpath
+import struct
+import zipfile
+
+from docx.document import Document as _Document
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import parse_xml
+
+CONTENT_TYPES_PART = '[Content_Types].xml'
+PACKAGE_RELS_PART = '_rels/.rels'
+CT_OVERRIDE = '{http://schemas.openxmlformats.org/package/2006/content-types}Override'
+REL_OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+# コメント本体と、Word 2013 以降が併せて書き出すコメント関連パーツ
+REL_COMMENTS = (
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships/comments',
+    'http://schemas.microsoft.com/office/2011/relationships/commentsExtended',
+    'http://schemas.microsoft.com/office/2016/09/relationships/commentsIds',
+    'http://schemas.microsoft.com/office/2018/08/relationships/commentsExtensible',
+)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+# データディスクリプタ（CRC・サイズをデータの後ろに書く方式）のフラグ
+_FLAG_DATA_DESCRIPTOR = 0x08
+
+
+def open_docx(source):
+    return LazyDocument(source)
+
+
+class LazyDocument:
+    """遅延読み込みの docx。python-docx の Document のうち本処理で使う部分
+    （element・paragraphs・save）と、ヘッダー等の取得・コメント削除を持つ。
+
+    解析したパーツ（_parts）は書き換え対象とみなし、save() で再シリアライズする。
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._parts = {}
+        self._removed = set()
+        with zipfile.ZipFile(source) as zf:
+            self._names = zf.namelist()
+            self.main_part = _main_document_part(zf)
+            self.element = self._parse(zf, self.main_part)
+        self._document = _Document(self.element, None)
+
+    @property
+    def paragraphs(self):
+        return self._document.paragraphs
+
+    def xml_parts(self, prefixes):
+        """パーツ名が prefixes（例: ('word/header', 'word/footer')）で始まるXMLパーツの要素一覧。"""
+        names = [n for n in self._names
+                 if n.startswith(prefixes) and n.endswith('.xml') and n not in self._removed]
+        pending = [n for n in names if n not in self._parts]
+        if pending:
+            with zipfile.ZipFile(self.source) as zf:
+                for name in pending:
+                    self._parse(zf, name)
+        return [self._parts[n] for n in names]
+
+    def remove_comments(self):
+        """コメントのパーツを、本文からの関連付けと [Content_Types].xml の登録ごと削除する。"""
+        rels_name = _rels_part_for(self.main_part)
+        if rels_name not in self._names:
+            return
+        with zipfile.ZipFile(self.source) as zf:
+            rels = parse_xml(zf.read(rels_name))
+            targets = set()
+            for rel in list(rels):
+                if rel.get('Type') in REL_COMMENTS and rel.get('TargetMode') != 'External':
+                    targets.add(_resolve(self.main_part, rel.get('Target')))
+                    rels.remove(rel)
+            if not targets:
+                return
+            content_types = self._parts.get(CONTENT_TYPES_PART)
+            if content_types is None:
+                content_types = self._parse(zf, CONTENT_TYPES_PART)
+        for override in list(content_types.iter(CT_OVERRIDE)):
+            if override.get('PartName', '').lstrip('/') in targets:
+                content_types.remove(override)
+        self._parts[rels_name] = rels
+        for target in targets:
+            self._removed.update((target, _rels_part_for(target)))
+
+    def save(self, path):
+        """解析したパーツは python-docx と同じ形式で書き出し、その他は圧縮済みのままコピーする。"""
+        with zipfile.ZipFile(self.source) as src, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as dst:
+            for info in src.infolist():
+                if info.filename in self._removed:
+                    continue
+                element = self._parts.get(info.filename)
+                if element is not None:
+                    dst.writestr(info.filename, serialize_part_xml(element))
+                else:
+                    _copy_raw(src, info, dst)
+
+    def _parse(self, zf, name):
+        element = self._parts[name] = parse_xml(zf.read(name))
+        return element
+
+
+def _main_document_part(zf):
+    """パッケージの関連付け（_rels/.rels）から本文パーツ名を求める。通常は word/document.xml。"""
+    rels = parse_xml(zf.read(PACKAGE_RELS_PART))
+    for rel in rels:
+        if rel.get('Type') == REL_OFFICE_DOCUMENT:
+            return _resolve('', rel.get('Target'))
+    raise ValueError('docx の本文パーツが見つかりません')
+
+
+def _rels_part_for(name):
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, '_rels', filename + '.rels')
+
+
+def _resolve(source_part, target):
+    """関連付けの Target（source_part からの相対パスまたは / 始まり）をZIP内のパーツ名にする。"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+def _copy_raw(src, info, dst):
+    """src のメンバーを展開せず、圧縮済みのバイト列のまま dst に追加する。
+
+    zipfile には生データをコピーする公開APIが無いため、ZipFile.mkdir と同じ手順で
+    ローカルヘッダーを書き、filelist に登録する（中央ディレクトリは close() 時に書かれる）。
+    CRC・サイズは中央ディレクトリの値をローカルヘッダーに書くので、データディスクリプタは付けない。
+    この手順が前提にする zipfile の内部状態が無い場合（Python のバージョン差など）は、
+    展開して書き直す（writestr）。
+    """
+    out = zipfile.ZipInfo(info.filename, info.date_time)
+    out.compress_type = info.compress_type
+    out.external_attr = info.external_attr
+    out.create_system = info.create_system
+    if not _can_copy_raw(src, dst):
+        dst.writestr(out, src.read(info))
+        return
+    out.CRC = info.CRC
+    out.compress_size = info.compress_size
+    out.file_size = info.file_size
+    out.flag_bits = info.flag_bits & ~_FLAG_DATA_DESCRIPTOR
+
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    src.fp.seek(name_length + extra_length, 1)
+
+    dst.fp.seek(dst.start_dir)
+    out.header_offset = dst.fp.tell()
+    dst.fp.write(out.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        block = src.fp.read(min(COPY_CHUNK_SIZE, remaining))
+        if not block:
+            raise zipfile.BadZipFile(f'{info.filename} のデータが途中で終わっています')
+        dst.fp.write(block)
+        remaining -= len(block)
+    dst.filelist.append(out)
+    dst.NameToInfo[out.filename] = out
+    dst.start_dir = dst.fp.tell()
+
+
+def _can_copy_raw(src, dst):
+    """_copy_raw が使う zipfile の非公開の属性がそろっていて、書き出し先がシークできるか。"""
+    return (getattr(src, 'fp', None) is not None and getattr(dst, 'fp', None) is not None
+            and all(hasattr(dst, name) for name in ('start_dir', 'filelist', 'NameToInfo'))
+            and hasattr(zipfile, 'sizeFileHeader') and hasattr(zipfile.ZipInfo, 'FileHeader')
+            and dst.fp.seekable())
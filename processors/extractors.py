@@ -0,0 +1,58 @@
+"""Excel・PDF からの法人情報抽出 — ブック・PDF全体を読み込まずに逐次読みする
+
+Excel は openpyxl の read_only モードで1行ずつ値だけを読み、
+PDF は pypdf で1ページずつテキストを取り出す。全項目が見つかった時点で読むのをやめる。
+"""
+import logging
+
+from openpyxl import load_workbook
+from pypdf import PdfReader
+
+from .common import extract_entity_info_from_lines
+
+logger = logging.getLogger(__name__)
+
+
+def iter_xlsx_lines(source):
+    """全シートのセルを行順に、セル単体・セルと右隣の（空でない）セルの組の順で返す。
+
+    「乙：」と会社名が別セルに分かれていても、隣のセルの値だけを拾える
+    （行全体を連結すると、同じ行の他のセルまで値に含まれてしまう）。
+    """
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                cells = [str(v).strip() for v in row if v is not None and str(v).strip()]
+                for i, cell in enumerate(cells):
+                    yield cell
+                    if i + 1 < len(cells):
+                        yield f'{cell} {cells[i + 1]}'
+    finally:
+        wb.close()
+
+
+def iter_pdf_lines(source):
+    """PDFのテキストを1ページずつ抽出し、行単位で返す。暗号化されたPDFは空とみなす。"""
+    reader = PdfReader(source)
+    if reader.is_encrypted and not reader.decrypt(''):
+        return
+    for page in reader.pages:
+        yield from (page.extract_text() or '').splitlines()
+
+
+def extract_entity_info_from_xlsx(source):
+    return _extract(iter_xlsx_lines, source)
+
+
+def extract_entity_info_from_pdf(source):
+    return _extract(iter_pdf_lines, source)
+
+
+def _extract(iter_lines, source):
+    """抽出に失敗した場合は None（突合の対象外）にして、処理自体は続ける。"""
+    try:
+        return extract_entity_info_from_lines(iter_lines(source))
+    except Exception as e:
+        logger.warning(f'Entity extraction failed: {e}')
+        return None
@@ -0,0 +1,77 @@
+"""読み取り専用の高速テキスト抽出 — python-docx を使わず本文XML（通常は word/document.xml）を逐次解析する
+
+チェックだけを行う場合は、python-docx の文書オブジェクト構築・保存は不要なため、
+本文XMLを iterparse で流し読みして段落テキストだけを取り出す。
+段落テキストの作り方は python-docx の Paragraph.text に合わせている。
+"""
+import zipfile
+
+from lxml import etree
+
+from .docx_io import _main_document_part
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_W = '{%s}' % W_NS
+W_BODY = _W + 'body'
+W_P = _W + 'p'
+W_R = _W + 'r'
+W_HYPERLINK = _W + 'hyperlink'
+W_T = _W + 't'
+W_BR = _W + 'br'
+W_TYPE = _W + 'type'
+
+# ラン内要素 → テキスト（w:br は改行種別によって異なるため別扱い）
+_RUN_TEXT = {
+    _W + 'tab': '\t',
+    _W + 'ptab': '\t',
+    _W + 'cr': '\n',
+    _W + 'noBreakHyphen': '-',
+}
+
+
+def iter_docx_paragraphs(source):
+    """docx（パスまたはファイルオブジェクト）の本文直下の段落テキストを順に返す。
+
+    doc.paragraphs と同じく、表の中の段落は含まない。読み終えた要素は順次破棄する。
+    本文パーツは _rels/.rels の関連付けから求める。
+    """
+    with zipfile.ZipFile(source) as zf, zf.open(_main_document_part(zf)) as xml:
+        body = None
+        for event, el in etree.iterparse(xml, events=('start', 'end')):
+            if event == 'start':
+                if el.tag == W_BODY:
+                    body = el
+                continue
+            if body is None or el.getparent() is not body:
+                continue
+            if el.tag == W_P:
+                yield _paragraph_text(el)
+            el.clear()
+            while el.getprevious() is not None:
+                del body[0]
+
+
+def read_docx_paragraphs(source):
+    return list(iter_docx_paragraphs(source))
+
+
+def _paragraph_text(p):
+    parts = []
+    for child in p:
+        if child.tag == W_R:
+            _run_text(child, parts)
+        elif child.tag == W_HYPERLINK:
+            for r in child.iterchildren(W_R):
+                _run_text(r, parts)
+    return ''.join(parts)
+
+
+def _run_text(r, parts):
+    for el in r:
+        if el.tag == W_T:
+            parts.append(el.text or '')
+        elif el.tag == W_BR:
+            if el.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif el.tag in _RUN_TEXT:
+            parts.append(_RUN_TEXT[el.tag])
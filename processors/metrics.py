@@ -0,0 +1,174 @@
+"""工程別の計測とPrometheus形式のメトリクス（/metrics 用）
+
+各工程の所要時間・バイト数は timed() で results['timings'] に記録する
+（{'stage', 'doc_type', 'format', 'seconds', 'bytes'} の辞書）。
+書類処理は子プロセスで行われるため、ヒストグラムへの反映は親プロセスで
+observe() をリクエスト（ジョブ）ごとに1回呼んで行う。
+
+起動からの経過時間（最初の応答・重いモジュールの読み込み完了・最初のPDFなど）は
+mark_startup() で1回だけ記録し、/health と /metrics で返す。
+LibreOffice の変換プロセスの資源使用量（CPU時間・ピークRSS）は observe_conversion() で反映する。
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 所要時間（秒）とファイルサイズ（バイト）のバケット境界
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (10_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000)
+# 変換プロセス（soffice）のピークRSS（バイト）のバケット境界
+MEMORY_BUCKETS = (50_000_000, 100_000_000, 250_000_000, 500_000_000, 1_000_000_000, 2_000_000_000,
+                  4_000_000_000)
+
+STAGE_LABELS = ('stage', 'doc_type', 'format')
+
+
+class Histogram:
+    """ラベル付きの累積ヒストグラム（Prometheus の histogram 型）。"""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for label_values, (counts, count, total) in items:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return '\n'.join(lines)
+
+
+STAGE_SECONDS = Histogram('contract_prepper_stage_seconds',
+                          'Duration of each processing stage.', STAGE_LABELS, SECONDS_BUCKETS)
+STAGE_BYTES = Histogram('contract_prepper_stage_bytes',
+                        'Bytes written or read by each processing stage.', STAGE_LABELS, BYTES_BUCKETS)
+CONVERSION_CPU_SECONDS = Histogram('contract_prepper_conversion_cpu_seconds',
+                                   'CPU time of each LibreOffice conversion process tree.',
+                                   ('outcome',), SECONDS_BUCKETS)
+CONVERSION_PEAK_RSS = Histogram('contract_prepper_conversion_peak_rss_bytes',
+                                'Peak RSS of each LibreOffice conversion process tree.',
+                                ('outcome',), MEMORY_BUCKETS)
+REGISTRY = [STAGE_SECONDS, STAGE_BYTES, CONVERSION_CPU_SECONDS, CONVERSION_PEAK_RSS]
+
+
+def _process_start_time():
+    """このプロセスの起動時刻（UNIX時刻）。/proc から取れなければ本モジュールの読み込み時刻。"""
+    try:
+        with open('/proc/self/stat') as f:
+            # 2番目の項目（実行ファイル名）は空白を含み得るので ')' 以降を分割する
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+
+PROCESS_STARTED = _process_start_time()
+_startup = {}
+_startup_lock = threading.Lock()
+
+
+@contextmanager
+def timed(timings, stage, doc_type='', fmt='', path=None):
+    """with ブロックの所要時間を timings に記録する。
+
+    path を渡すと、ブロック終了後のそのファイルサイズを bytes として記録する。
+    記録した辞書を返すので、呼び出し側で bytes などを後から設定してもよい。
+    """
+    entry = {'stage': stage, 'doc_type': doc_type, 'format': fmt}
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry['seconds'] = round(time.perf_counter() - start, 6)
+        if path is not None and os.path.exists(path):
+            entry['bytes'] = os.path.getsize(path)
+        timings.append(entry)
+
+
+def file_format(path):
+    """ラベル用のファイル形式（拡張子、ドットなし・小文字）。"""
+    return os.path.splitext(path)[1].lstrip('.').lower()
+
+
+def observe(timings):
+    """記録済みの工程をヒストグラムに反映する。"""
+    for entry in timings:
+        labels = (entry['stage'], entry.get('doc_type', ''), entry.get('format', ''))
+        STAGE_SECONDS.observe(entry['seconds'], *labels)
+        if entry.get('bytes') is not None:
+            STAGE_BYTES.observe(entry['bytes'], *labels)
+
+
+def observe_conversion(usage):
+    """変換プロセス1回分の資源使用量（runner.run_limited の usage）をヒストグラムに反映する。"""
+    if usage.get('cpu_seconds') is not None:
+        CONVERSION_CPU_SECONDS.observe(usage['cpu_seconds'], usage['outcome'])
+    if usage.get('peak_rss_mb') is not None:
+        CONVERSION_PEAK_RSS.observe(usage['peak_rss_mb'] * 1024 * 1024, usage['outcome'])
+
+
+def mark_startup(event):
+    """プロセス起動から event までの秒数を記録する。記録済みの event は上書きしない。"""
+    with _startup_lock:
+        if event in _startup:
+            return
+        _startup[event] = round(time.time() - PROCESS_STARTED, 3)
+    logger.info(f'Startup: {event} after {_startup[event]}s')
+
+
+def startup_times():
+    """{event: 起動からの秒数}"""
+    with _startup_lock:
+        return dict(_startup)
+
+
+def render():
+    """Prometheus テキスト形式のメトリクス。"""
+    lines = ['# HELP contract_prepper_startup_seconds Seconds from process start to each startup event.',
+             '# TYPE contract_prepper_startup_seconds gauge']
+    lines.extend(f'contract_prepper_startup_seconds{{event="{_escape(event)}"}} {seconds}'
+                 for event, seconds in sorted(startup_times().items()))
+    return '\n'.join([h.render() for h in REGISTRY] + lines) + '\n'
+
+
+def server_timing(timings):
+    """Server-Timing ヘッダー値（工程ごとの合計ミリ秒）。"""
+    totals = {}
+    for entry in timings:
+        name = entry['stage'] if not entry.get('doc_type') else f"{entry['doc_type']}-{entry['stage']}"
+        totals[name] = totals.get(name, 0.0) + entry['seconds']
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
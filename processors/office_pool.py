@@ -0,0 +1,238 @@
+"""LibreOffice常駐ワーカープール — UNO接続でPDF変換を行う
+
+変換ごとに soffice を起動するとプロファイル作成と起動で数秒かかるため、
+ヘッドレスの soffice を N 個常駐させ、UNO (pipe/socket) 経由でジョブを渡す。
+プールは gunicorn ワーカーごとに初回利用時に起動される。
+OFFICE_POOL_ENDPOINTS を指定すると、外部で起動済みの soffice（サイドカー）へ接続する。
+"""
+import logging
+import os
+import pathlib
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from .runner import CONVERT_CPU_SECONDS, kill_tree, popen_limited
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get('OFFICE_POOL_SIZE', '2'))
+MAX_JOBS_PER_WORKER = int(os.environ.get('OFFICE_POOL_MAX_JOBS', '50'))
+JOB_TIMEOUT = int(os.environ.get('OFFICE_JOB_TIMEOUT', '120'))
+STARTUP_TIMEOUT = int(os.environ.get('OFFICE_STARTUP_TIMEOUT', '60'))
+# サイドカー: 空白区切りのUNO接続文字列 (例: "socket,host=127.0.0.1,port=2002")
+SIDECAR_ENDPOINTS = os.environ.get('OFFICE_POOL_ENDPOINTS', '').split()
+# 初期化済みユーザープロファイルの雛形（warmup.py が作る）。起動ごとの一時プロファイルにコピーし、
+# soffice 初回起動時のプロファイル生成を省く
+PROFILE_TEMPLATE = os.environ.get(
+    'LO_PROFILE_TEMPLATE', os.path.join(tempfile.gettempdir(), 'contract_prepper_lo_profile'))
+
+
+def import_uno(lo_path):
+    """pyuno を読み込む。見つからなければ LibreOffice の program ディレクトリも探す。"""
+    try:
+        import uno
+        return uno
+    except ImportError:
+        pass
+    program_dir = os.path.dirname(os.path.realpath(lo_path))
+    if program_dir not in sys.path:
+        sys.path.append(program_dir)
+    try:
+        import uno
+        return uno
+    except ImportError:
+        return None
+
+
+def profile_template_ready():
+    return os.path.isdir(os.path.join(PROFILE_TEMPLATE, 'user'))
+
+
+def new_profile_dir():
+    """soffice 用の一時ユーザープロファイルを作る。雛形があれば中身をコピーしておく。"""
+    profile_dir = tempfile.mkdtemp(prefix='lo_profile_')
+    if profile_template_ready():
+        try:
+            shutil.copytree(PROFILE_TEMPLATE, profile_dir, dirs_exist_ok=True)
+        except OSError as e:
+            logger.warning(f'Failed to copy LibreOffice profile template: {e}')
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            profile_dir = tempfile.mkdtemp(prefix='lo_profile_')
+    return profile_dir
+
+
+def _prop(uno, name, value):
+    pv = uno.createUnoStruct('com.sun.star.beans.PropertyValue')
+    pv.Name = name
+    pv.Value = value
+    return pv
+
+
+class OfficeWorker:
+    """常駐 soffice 1プロセス分。専用のユーザープロファイルを持つ。"""
+
+    def __init__(self, lo_path, uno, endpoint=None):
+        self.lo_path = lo_path
+        self.uno = uno
+        self.endpoint = endpoint
+        self.proc = None
+        self.profile_dir = None
+        self.desktop = None
+        self.jobs = 0
+
+    @property
+    def started(self):
+        return self.desktop is not None
+
+    def start(self):
+        if self.endpoint:
+            connect = self.endpoint
+        else:
+            self.profile_dir = new_profile_dir()
+            connect = f'pipe,name=contract_prepper_{os.getpid()}_{uuid.uuid4().hex[:8]}'
+            # 常駐プロセスの CPU 時間は再起動までの全ジョブの合計なので、上限もジョブ数倍にする
+            self.proc = popen_limited(
+                [self.lo_path, '--headless', '--invisible', '--norestore',
+                 '--nologo', '--nodefault', '--nofirststartwizard',
+                 f'-env:UserInstallation={pathlib.Path(self.profile_dir).as_uri()}',
+                 f'--accept={connect};urp;StarOffice.ComponentContext'],
+                cpu_seconds=CONVERT_CPU_SECONDS * MAX_JOBS_PER_WORKER,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+        self.desktop = self._connect(connect)
+        self.jobs = 0
+        logger.info(f'LibreOffice worker ready: {connect}')
+
+    def _connect(self, connect):
+        local_ctx = self.uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_ctx)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if self.proc is not None and self.proc.poll() is not None:
+                raise RuntimeError(f'LibreOfficeワーカーが起動直後に終了しました (code={self.proc.returncode})')
+            try:
+                ctx = resolver.resolve(f'uno:{connect};urp;StarOffice.ComponentContext')
+                return ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+            except Exception:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f'LibreOfficeワーカーに接続できません: {connect}')
+                time.sleep(0.25)
+
+    def healthy(self):
+        if self.proc is not None and self.proc.poll() is not None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def stop(self, force=False):
+        """ワーカーを終了する。force=True（応答しない場合）は終了要求を送らず、子孫プロセスごと強制終了する。"""
+        desktop, self.desktop = self.desktop, None
+        if self.proc is not None:
+            try:
+                if desktop is not None and not force:
+                    desktop.terminate()
+            except Exception:
+                pass
+            try:
+                self.proc.wait(timeout=0 if force else 5)
+            except subprocess.TimeoutExpired:
+                kill_tree(self.proc)
+                self.proc.wait()
+            # 親の終了後に残った子孫プロセスも片付ける
+            kill_tree(self.proc)
+            self.proc = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+    def ensure_ready(self, max_jobs):
+        """未起動・不健全・ジョブ上限到達のいずれかなら (再)起動する。"""
+        if self.started and self.jobs < max_jobs and self.healthy():
+            return
+        if self.started:
+            logger.info(f'Restarting LibreOffice worker after {self.jobs} jobs')
+            self.stop()
+        self.start()
+
+    def convert(self, src, pdf_path, filter_name, timeout, filter_data=None):
+        outcome = {}
+        store_args = [_prop(self.uno, 'FilterName', filter_name)]
+        if filter_data:
+            options = tuple(_prop(self.uno, name, value) for name, value in filter_data.items())
+            store_args.append(_prop(self.uno, 'FilterData',
+                                    self.uno.Any('[]com.sun.star.beans.PropertyValue', options)))
+
+        def export():
+            try:
+                doc = self.desktop.loadComponentFromURL(
+                    self.uno.systemPathToFileUrl(os.path.abspath(src)), '_blank', 0,
+                    (_prop(self.uno, 'Hidden', True), _prop(self.uno, 'ReadOnly', True)))
+                if doc is None:
+                    raise RuntimeError(f'LibreOfficeで開けませんでした: {os.path.basename(src)}')
+                try:
+                    doc.storeToURL(
+                        self.uno.systemPathToFileUrl(os.path.abspath(pdf_path)),
+                        tuple(store_args))
+                finally:
+                    doc.close(True)
+            except Exception as e:
+                outcome['error'] = e
+
+        t = threading.Thread(target=export, daemon=True)
+        t.start()
+        t.join(timeout)
+        self.jobs += 1
+        if t.is_alive():
+            # 応答しないワーカーは子孫プロセスごと破棄し、次回利用時に再起動させる
+            self.stop(force=True)
+            raise TimeoutError(f'PDF変換がタイムアウトしました ({timeout}秒): {os.path.basename(src)}')
+        if 'error' in outcome:
+            raise outcome['error']
+
+
+class OfficePool:
+    """常駐ワーカーのプール。空きワーカーを1つ借りてジョブを実行する。"""
+
+    def __init__(self, lo_path, uno, size=POOL_SIZE, endpoints=SIDECAR_ENDPOINTS,
+                 max_jobs=MAX_JOBS_PER_WORKER, job_timeout=JOB_TIMEOUT):
+        self.max_jobs = max_jobs
+        self.job_timeout = job_timeout
+        self._workers = ([OfficeWorker(lo_path, uno, endpoint=e) for e in endpoints]
+                         or [OfficeWorker(lo_path, uno) for _ in range(size)])
+        self._idle = queue.Queue()
+        for w in self._workers:
+            self._idle.put(w)
+
+    @property
+    def size(self):
+        return len(self._workers)
+
+    def convert(self, src, pdf_path, filter_name, filter_data=None):
+        try:
+            worker = self._idle.get(timeout=self.job_timeout)
+        except queue.Empty:
+            raise TimeoutError('空きのLibreOfficeワーカーがありません')
+        try:
+            worker.ensure_ready(self.max_jobs)
+            worker.convert(src, pdf_path, filter_name, self.job_timeout, filter_data)
+        except Exception:
+            if not worker.healthy():
+                worker.stop()
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        for w in self._workers:
+            w.stop()
@@ -0,0 +1,381 @@
+"""書類一式（パッケージ）の処理: 各書類の整形 → 突合チェック → PDF変換 → ZIP作成"""
+import logging
+import multiprocessing
+import os
+import threading
+import traceback
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from .catalog import FILE_TYPES
+from .common import cross_check_entities, link_or_copy
+from .contract import process_contract
+from .estimate import process_estimate
+from .oath import process_oath
+from .checklist import process_checklist
+from .confirmation import process_confirmation
+from .metrics import timed, file_format
+from .pdf_cache import content_hash
+from .pdf_converter import convert_to_pdf, convert_many_to_pdf, get_pool, resolve_profile
+from .rules import RULES
+from .session_store import get_session_store, slot_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# ZIPストリーミング時のチャンクサイズ（1リクエストあたりのバッファ上限の目安）
+ZIP_CHUNK_SIZE = 64 * 1024
+# 既に圧縮済みの形式は再圧縮せず無圧縮で格納する（docx/xlsxもZIPコンテナ）
+STORED_EXTENSIONS = ('.pdf', '.docx', '.xlsx', '.zip', '.png', '.jpg', '.jpeg')
+
+# PDF変換の同時実行数（変換自体はLibreOfficeプロセス側で行われるためスレッドで十分）
+PDF_CONVERT_WORKERS = int(os.environ.get('PDF_CONVERT_WORKERS', '5'))
+# 書類ごとの整形処理の並列数。python-docx の処理はCPU律速なのでプロセスで並列化する（1なら逐次）
+DOC_PROCESS_WORKERS = int(os.environ.get(
+    'DOC_PROCESS_WORKERS', str(min(len(FILE_TYPES), os.cpu_count() or 1))))
+
+_doc_executor = None
+_doc_executor_pid = None
+_doc_executor_lock = threading.Lock()
+
+
+def stage_document(key, original_name, save, work_dir, backup_dir, timings=None):
+    """1ファイルを作業ディレクトリに保存し、元ファイル名でバックアップを作る。
+
+    save(path) で実体を書き出す（FileStorage.save やファイルコピー）。保存先パスを返す。
+    書き出しは1回だけで、バックアップは同じ実体へのハードリンクにする。
+    timings を渡すと保存・バックアップの所要時間を記録する。
+    """
+    timings = [] if timings is None else timings
+    # secure_filename strips Japanese chars, so preserve extension manually
+    ext = os.path.splitext(original_name)[1].lower()
+    safe_name = f'{key}_{uuid.uuid4().hex[:8]}{ext}'
+    filepath = os.path.join(work_dir, safe_name)
+    with timed(timings, 'upload_save', key, file_format(original_name), path=filepath):
+        save(filepath)
+    # Backup original with original filename (sanitised minimally)
+    backup_name = original_name.replace('/', '_').replace('\\', '_')
+    backup_path = os.path.join(backup_dir, backup_name)
+    with timed(timings, 'backup_link', key, file_format(original_name), path=backup_path):
+        link_or_copy(filepath, backup_path)
+    return filepath
+
+
+def process_package(uploaded_docs, output_dir, company_name, approval_type,
+                    appendix2_choice, appendix2_dir, results, progress=None, session_id=None,
+                    pdf_profile=None):
+    """アップロード済みの書類を処理・突合し、output_dir の成果物をPDF化する。
+
+    uploaded_docs は {書類キー: ファイルパス}。エラー・警告は results に積む。
+    progress(key, state) を渡すと、書類ごとに 'processed' / 'converted' / 'failed' を通知する。
+    session_id を渡すと、前回の提出から入力・オプションが変わっていない書類は保存済みの
+    成果物を再利用し、変わった書類だけ整形・PDF変換する（突合チェックは毎回全書類で行う）。
+    pdf_profile は PDF出力プロファイル名（pdf_converter.PDF_PROFILES のキー、省略時は既定）。
+    戻り値は {書類キー: PDF変換後の成果物パスのリスト}（整形・PDF変換に失敗した書類は None または空）。
+    """
+    progress = progress or (lambda key, state: None)
+    store = get_session_store() if session_id else None
+    with timed(results['timings'], 'package'):
+        slots, fingerprints = {}, {}
+        if store is not None:
+            options = {'company_name': company_name, 'approval_type': approval_type,
+                       'appendix2_choice': appendix2_choice, 'pdf_profile': resolve_profile(pdf_profile),
+                       'appendix2_hash': _appendix2_hash(appendix2_choice, appendix2_dir),
+                       'rules_version': RULES.version}
+            for key, filepath in uploaded_docs.items():
+                with timed(results['timings'], 'fingerprint', key, file_format(filepath)) as entry:
+                    fingerprints[key] = slot_fingerprint(filepath, key, options)
+                    reused = store.restore(session_id, key, fingerprints[key], output_dir)
+                    if reused is not None:
+                        entry['stage'] = 'reuse'
+                if reused is not None:
+                    logger.info(f"Reusing {key} from session {session_id}")
+                    slots[key] = reused
+                    progress(key, 'converted')
+        reused_keys = set(slots)
+
+        outputs = process_documents(uploaded_docs, output_dir, company_name, approval_type,
+                                    appendix2_choice, appendix2_dir, results, progress,
+                                    slot_results=slots)
+
+        # Convert all output docx/xlsx to PDF
+        logger.info(f"Converting files to PDF in {output_dir}")
+        convert_outputs(output_dir, results,
+                        lambda fname, ok: outputs.get(fname) and progress(outputs[fname], 'converted' if ok else 'failed'),
+                        doc_types=outputs, profile=pdf_profile)
+
+        documents = {key: _final_outputs(output_dir, slots[key].get('output_name')) for key in slots}
+        if store is not None:
+            for key in slots.keys() - reused_keys:
+                if documents[key] is not None:
+                    store.save(session_id, key, fingerprints[key], slots[key], documents[key])
+    return documents
+
+
+def _appendix2_hash(appendix2_choice, appendix2_dir):
+    """差し替える別紙2ファイルの内容のハッシュ。同じファイル名のまま差し替えられても再処理させる。"""
+    if not appendix2_choice:
+        return ''
+    path = os.path.join(appendix2_dir, appendix2_choice)
+    return content_hash(path) if os.path.isfile(path) else ''
+
+
+def _final_outputs(output_dir, output_name):
+    """書類1通分のPDF変換後の成果物パス。PDF変換に失敗していれば None（保存・再利用しない）。"""
+    if not output_name:
+        return []
+    if output_name.lower().endswith('.pdf'):
+        path = os.path.join(output_dir, output_name)
+        return [path] if os.path.exists(path) else None
+    if os.path.exists(os.path.join(output_dir, output_name)):
+        return None
+    pdf_path = os.path.join(output_dir, os.path.splitext(output_name)[0] + '.pdf')
+    return [pdf_path] if os.path.exists(pdf_path) else None
+
+
+def process_documents(uploaded_docs, output_dir, company_name, approval_type,
+                      appendix2_choice, appendix2_dir, results, progress=None, parallel=True,
+                      slot_results=None):
+    """各書類を整形して output_dir に保存し、書類間の突合チェックまで行う（PDF変換はしない）。
+
+    parallel=True なら書類ごとにプロセスプールで並列処理し、全書類の完了後に突合する。
+    slot_results（{書類キー: 処理結果}）にある書類は処理せずその結果を使い、
+    処理した書類の結果も slot_results に書き足す。
+    戻り値は {成果物ファイル名: 書類キー}。
+    """
+    progress = progress or (lambda key, state: None)
+    keys = [key for key in FILE_TYPES if key in uploaded_docs]
+    responses = {} if slot_results is None else slot_results
+    pending = [key for key in keys if key not in responses]
+    args = {key: (key, uploaded_docs[key], output_dir, company_name, approval_type,
+                  appendix2_choice, appendix2_dir) for key in pending}
+    failures = {}
+    logger.info(f"Processing {len(uploaded_docs)} files for company: {company_name}")
+
+    def collect(key, get_result):
+        try:
+            res = responses[key] = get_result()
+        except Exception as e:
+            failures[key] = e
+            progress(key, 'failed')
+            return
+        progress(key, 'processed' if res['output_name'] else 'failed')
+
+    executor = _get_doc_executor() if parallel and len(pending) > 1 else None
+    if executor is not None:
+        futures = {executor.submit(_run_processor, *args[key]): key for key in pending}
+        for future in as_completed(futures):
+            collect(futures[future], future.result)
+    else:
+        for key in pending:
+            logger.info(f"Processing {key}...")
+            collect(key, lambda key=key: _run_processor(*args[key]))
+
+    entity_infos = {}
+    outputs = {}
+    for key in keys:
+        if key in failures:
+            if isinstance(failures[key], BrokenProcessPool):
+                _reset_doc_executor()
+            raise failures[key]
+        res = responses[key]
+        for entry in res.get('timings', []):
+            entry.update(doc_type=key, format=file_format(uploaded_docs[key]))
+            results['timings'].append(entry)
+        results['processed'].append(res['output_name'])
+        results['errors'].extend(res.get('errors', []))
+        results['warnings'].extend(res.get('warnings', []))
+        if res.get('entity_info'):
+            entity_infos[key] = res['entity_info']
+        if res['output_name']:
+            outputs[res['output_name']] = key
+
+    # Cross-check entity info
+    if len(entity_infos) > 1:
+        with timed(results['timings'], 'cross_check'):
+            cross_errors = cross_check_entities(entity_infos)
+        results['errors'].extend(cross_errors)
+
+    return outputs
+
+
+def _get_doc_executor():
+    """書類処理用のプロセスプール（プロセスごとに1つ）。DOC_PROCESS_WORKERS<=1 なら None。"""
+    global _doc_executor, _doc_executor_pid
+    if DOC_PROCESS_WORKERS <= 1:
+        return None
+    with _doc_executor_lock:
+        if _doc_executor is None or _doc_executor_pid != os.getpid():
+            # spawn: スレッドを持つ gunicorn ワーカーからでも安全に子プロセスを作る
+            _doc_executor = ProcessPoolExecutor(
+                max_workers=DOC_PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            _doc_executor_pid = os.getpid()
+        return _doc_executor
+
+
+def _reset_doc_executor():
+    """子プロセスが異常終了したプールを破棄し、次回作り直させる。"""
+    global _doc_executor
+    with _doc_executor_lock:
+        if _doc_executor is not None:
+            _doc_executor.shutdown(wait=False)
+            _doc_executor = None
+
+
+def _run_processor(key, filepath, output_dir, company_name, approval_type,
+                   appendix2_choice, appendix2_dir):
+    timings = []
+    with timed(timings, 'process'):
+        result = _dispatch_processor(key, filepath, output_dir, company_name, approval_type,
+                                     appendix2_choice, appendix2_dir)
+    result['timings'].extend(timings)
+    return result
+
+
+def _dispatch_processor(key, filepath, output_dir, company_name, approval_type,
+                        appendix2_choice, appendix2_dir):
+    if key == 'contract':
+        return process_contract(filepath, output_dir, company_name,
+                                approval_type, appendix2_choice, appendix2_dir)
+    if key == 'estimate':
+        return process_estimate(filepath, output_dir, company_name)
+    if key == 'oath':
+        return process_oath(filepath, output_dir, company_name)
+    if key == 'checklist':
+        return process_checklist(filepath, output_dir, company_name)
+    if key == 'confirmation':
+        return process_confirmation(filepath, output_dir, company_name)
+    raise ValueError(f'未対応の書類種別です: {key}')
+
+
+def convert_outputs(output_dir, results, on_done=None, doc_types=None, profile=None):
+    """output_dir内のdocx/xlsxをPDF変換する。失敗分は元ファイルを残して警告に積む。
+
+    on_done(元ファイル名, 成否) で1ファイルごとの結果を通知する。
+    元からPDFのファイルは変換済みとして通知する。
+    doc_types（{ファイル名: 書類キー}）は変換時間の記録に使う。
+    profile は PDF出力プロファイル名（省略時は既定）。
+    """
+    profile = resolve_profile(profile)
+    on_done = on_done or (lambda fname, ok: None)
+    doc_types = doc_types or {}
+    timings = results['timings']
+    names = sorted(os.listdir(output_dir))
+    for fname in names:
+        if fname.endswith('.pdf'):
+            on_done(fname, True)
+    targets = [f for f in names if f.endswith(('.docx', '.xlsx'))]
+    if not targets:
+        return
+
+    # 常駐プールが無い場合は、LibreOfficeを1回だけ起動してまとめて変換する
+    if len(targets) > 1 and get_pool() is None:
+        with timed(timings, 'pdf_batch') as entry:
+            converted, failed = convert_many_to_pdf([os.path.join(output_dir, f) for f in targets], profile)
+            entry['profile'] = profile
+            entry['bytes'] = sum(os.path.getsize(p) for p in converted.values())
+        for src, pdf_path in converted.items():
+            logger.info(f"Converted: {pdf_path}")
+            os.remove(src)
+            on_done(os.path.basename(src), True)
+        for src, message in failed.items():
+            fname = os.path.basename(src)
+            logger.error(f"PDF conversion failed for {fname}: {message}")
+            results['warnings'].append(f'{fname} のPDF変換に失敗: {message}。元ファイルを同梱します。')
+            on_done(fname, False)
+        return
+
+    def convert(fname):
+        fpath = os.path.join(output_dir, fname)
+        logger.info(f"Converting {fname} to PDF...")
+        with timed(timings, 'pdf', doc_types.get(fname, ''), file_format(fname)) as entry:
+            pdf_path = convert_to_pdf(fpath, profile)
+            entry['profile'] = profile
+            entry['bytes'] = os.path.getsize(pdf_path)
+        logger.info(f"Converted: {pdf_path}")
+        os.remove(fpath)
+
+    width = max(1, min(PDF_CONVERT_WORKERS, len(targets)))
+    with ThreadPoolExecutor(max_workers=width) as executor:
+        futures = [(fname, executor.submit(convert, fname)) for fname in targets]
+        for fname, future in futures:
+            try:
+                future.result()
+                on_done(fname, True)
+            except Exception as e:
+                logger.error(f"PDF conversion failed for {fname}: {str(e)}\n{traceback.format_exc()}")
+                results['warnings'].append(f'{fname} のPDF変換に失敗: {str(e)}。元ファイルを同梱します。')
+                on_done(fname, False)
+
+
+def package_members(output_dir, backup_dir, prefix=''):
+    """ZIPに入れる (ファイルパス, 格納名) の一覧。成果物とバックアップを分けて格納する。"""
+    members = []
+    for fname in sorted(os.listdir(output_dir)):
+        members.append((os.path.join(output_dir, fname), f'{prefix}成果物/{fname}'))
+    for fname in sorted(os.listdir(backup_dir)):
+        members.append((os.path.join(backup_dir, fname), f'{prefix}バックアップ/{fname}'))
+    return members
+
+
+def write_zip(fileobj, members):
+    """members の (ファイルパス, 格納名) をZIPにまとめて fileobj に書き出す。"""
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, arcname in members:
+            zf.write(path, arcname, compress_type=_compress_type(path))
+
+
+def iter_zip(members, chunk_size=ZIP_CHUNK_SIZE):
+    """members のZIPを、圧縮しながらチャンク単位で返すジェネレータ。
+
+    アーカイブ全体をメモリに載せないため、レスポンスへそのまま流せる。
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, arcname in members:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = _compress_type(path)
+            with open(path, 'rb') as src, zf.open(zinfo, 'w') as dest:
+                while True:
+                    block = src.read(chunk_size)
+                    if not block:
+                        break
+                    dest.write(block)
+                    if sink.size >= chunk_size:
+                        yield sink.drain()
+            if sink.size:
+                yield sink.drain()
+    if sink.size:
+        yield sink.drain()
+
+
+class _ChunkSink:
+    """ZipFile の書き込み先。書かれたバイト列を溜め、iter_zip が取り出す。
+
+    tell/seek を持たないため、ZipFile はデータディスクリプタ方式で書き出す。
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def _compress_type(path):
+    if path.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
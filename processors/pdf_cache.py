@@ -0,0 +1,106 @@
+"""PDF変換キャッシュ — 入力内容のハッシュをキーに変換済みPDFをディスクに保持する
+
+同じ書類の再提出で変換をやり直さないためのキャッシュ。
+キーは docx/xlsx の正規化した中身（ZIPのタイムスタンプや保存日時を除く）と
+エクスポートフィルタ設定から作る。容量上限を超えたら最終利用が古い順に削除する（LRU）。
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = os.environ.get(
+    'PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'contract_prepper_pdf_cache'))
+PDF_CACHE_MAX_MB = int(os.environ.get('PDF_CACHE_MAX_MB', '500'))
+
+# openpyxl などは保存のたびに更新日時を書き換えるため、キー計算から除く
+_MODIFIED_RE = re.compile(rb'<dcterms:modified[^>]*>[^<]*</dcterms:modified>')
+
+
+def content_hash(filepath, *extra):
+    """docx/xlsxの中身を正規化したハッシュ。ZIPでなければファイルのバイト列をそのまま使う。"""
+    h = hashlib.sha256()
+    for value in extra:
+        h.update(str(value).encode('utf-8') + b'\0')
+    try:
+        with zipfile.ZipFile(filepath) as zf:
+            for name in sorted(zf.namelist()):
+                data = zf.read(name)
+                if name == 'docProps/core.xml':
+                    data = _MODIFIED_RE.sub(b'', data)
+                h.update(name.encode('utf-8') + b'\0')
+                h.update(hashlib.sha256(data).digest())
+    except zipfile.BadZipFile:
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+class PdfCache:
+    """容量上限付きのLRUディスクキャッシュ。"""
+
+    def __init__(self, directory=PDF_CACHE_DIR, max_bytes=PDF_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pdf')
+
+    def fetch(self, key, pdf_path):
+        """キャッシュにあれば pdf_path にコピーして True を返す。"""
+        cached = self._path(key)
+        try:
+            shutil.copyfile(cached, pdf_path)
+            os.utime(cached)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            logger.info(f'PDF cache miss (hits={self.hits}, misses={self.misses})')
+            return False
+        with self._lock:
+            self.hits += 1
+        logger.info(f'PDF cache hit: {os.path.basename(pdf_path)} (hits={self.hits}, misses={self.misses})')
+        return True
+
+    def store(self, key, pdf_path):
+        """変換結果をキャッシュに登録し、上限を超えた分を古い順に削除する。"""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(pdf_path, tmp)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            logger.warning(f'PDF cache store failed: {e}')
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pdf'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                total -= size
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -1,52 +1,306 @@
 """PDF変換ユーティリティ — LibreOffice使用"""
+import atexit
+import json
+import logging
 import os
 import subprocess
 import shutil
-import tempfile
+import sys
+import threading
 
+from .metrics import mark_startup
+from .office_pool import OfficePool, import_uno, new_profile_dir, POOL_SIZE, SIDECAR_ENDPOINTS
+from .pdf_cache import PdfCache, content_hash, PDF_CACHE_MAX_MB
+from .runner import CONVERT_CPU_SECONDS, run_limited
 
-def convert_to_pdf(filepath):
-    """docx/xlsxファイルをPDFに変換する。元ファイルと同じディレクトリにPDFを出力。"""
+logger = logging.getLogger(__name__)
+
+# PDF出力プロファイル。filter_data は LibreOffice の PDF エクスポートフィルタにそのまま渡す
+# （writer_pdf_Export / calc_pdf_Export 共通）。optimize は変換後の重複統合・線形化（pdf_optimize）
+PDF_PROFILES = {
+    'balanced': {
+        'label': '標準（JPEG品質90・300dpi）',
+        'filter_data': {'UseLosslessCompression': False, 'Quality': 90,
+                        'ReduceImageResolution': True, 'MaxImageResolution': 300,
+                        'EmbedStandardFonts': True},
+        'optimize': False,
+    },
+    'archive': {
+        'label': '保存用（画質・レイアウト優先、可逆圧縮）',
+        'filter_data': {'UseLosslessCompression': True, 'Quality': 100,
+                        'ReduceImageResolution': False, 'EmbedStandardFonts': True},
+        'optimize': False,
+    },
+    'web': {
+        'label': '軽量（低速回線・メール向け、JPEG品質75・150dpi）',
+        'filter_data': {'UseLosslessCompression': False, 'Quality': 75,
+                        'ReduceImageResolution': True, 'MaxImageResolution': 150,
+                        'EmbedStandardFonts': False},
+        'optimize': True,
+    },
+}
+PDF_PROFILE = os.environ.get('PDF_PROFILE', 'balanced')
+# 変換後の最適化: '1' なら全プロファイルで行う、'0' なら行わない、未指定ならプロファイルの設定に従う
+PDF_OPTIMIZE = os.environ.get('PDF_OPTIMIZE', '')
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# 常駐プールの状態（/health で返す）: 'enabled' / 'disabled'（設定で無効）/ 'unavailable'（設定は有効だが起動できない）
+_pool_status = 'disabled'
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def convert_to_pdf(filepath, profile=None):
+    """docx/xlsxファイルをPDFに変換する。元ファイルと同じディレクトリにPDFを出力。
+
+    常駐ワーカープールが使えればそちらで変換し、使えなければ soffice を都度起動する。
+    profile は PDF_PROFILES のキー（省略時は PDF_PROFILE）。
+    """
+    profile = resolve_profile(profile)
+    pdf_path = _pdf_path_for(filepath)
+    cache = get_cache()
+    key = _cache_key(filepath, profile) if cache is not None else None
+    if key and cache.fetch(key, pdf_path):
+        return pdf_path
+
+    _convert_uncached(filepath, pdf_path, profile)
+    _postprocess(pdf_path, profile)
+    mark_startup('first_pdf')
+    if key:
+        cache.store(key, pdf_path)
+    return pdf_path
+
+
+def _convert_uncached(filepath, pdf_path, profile=None):
+    profile = resolve_profile(profile)
     output_dir = os.path.dirname(filepath)
     base_name = os.path.splitext(os.path.basename(filepath))[0]
-    pdf_path = os.path.join(output_dir, base_name + '.pdf')
 
+    pool = get_pool()
+    if pool is not None:
+        try:
+            pool.convert(filepath, pdf_path, _export_filter(filepath),
+                         PDF_PROFILES[profile]['filter_data'])
+            if os.path.exists(pdf_path):
+                return
+        except Exception as e:
+            logger.warning(f'Pool conversion failed for {base_name}, falling back to cold start: {e}')
+
+    proc = _run_soffice(_require_libreoffice(), [filepath], output_dir, profile=profile)
+
+    if os.path.exists(pdf_path):
+        return
+
+    raise RuntimeError(
+        f'PDF変換に失敗しました: {base_name}\n'
+        f'stdout: {proc.stdout}\nstderr: {proc.stderr}'
+    )
+
+
+def convert_many_to_pdf(paths, profile=None):
+    """複数のdocx/xlsxをまとめてPDFに変換する（出力先・エクスポートフィルタごとに soffice 1回）。
+
+    PDFは各元ファイルと同じディレクトリに出力する。
+    戻り値は ({元ファイル: PDFパス}, {元ファイル: エラーメッセージ}) のタプル。
+    """
+    profile = resolve_profile(profile)
+    converted, failed = {}, {}
+    cache = get_cache()
+    keys = {}
+    if cache is not None:
+        for src in paths:
+            keys[src] = _cache_key(src, profile)
+            if cache.fetch(keys[src], _pdf_path_for(src)):
+                converted[src] = _pdf_path_for(src)
+        paths = [src for src in paths if src not in converted]
+    if not paths:
+        return converted, failed
+
+    try:
+        lo_path = _require_libreoffice()
+    except RuntimeError as e:
+        # LibreOffice が無い環境でも処理は続け、全ファイルを失敗として返す（元ファイルを同梱する）
+        failed.update((src, str(e)) for src in paths)
+        return converted, failed
+    for output_dir, batch in _group_batches(paths):
+        for src in batch:
+            stale = _pdf_path_for(src)
+            if os.path.exists(stale):
+                os.remove(stale)
+        try:
+            proc = _run_soffice(lo_path, batch, output_dir, timeout=120 * len(batch), profile=profile,
+                                cpu_seconds=CONVERT_CPU_SECONDS * len(batch))
+            detail = f'stdout: {proc.stdout}\nstderr: {proc.stderr}'
+        except subprocess.TimeoutExpired as e:
+            detail = f'タイムアウトしました ({e.timeout}秒)'
+        except OSError as e:
+            detail = f'LibreOfficeを起動できませんでした: {e}'
+
+        for src in batch:
+            pdf_path = _pdf_path_for(src)
+            if os.path.exists(pdf_path):
+                _postprocess(pdf_path, profile)
+                converted[src] = pdf_path
+                mark_startup('first_pdf')
+                if src in keys:
+                    cache.store(keys[src], pdf_path)
+            else:
+                base_name = os.path.splitext(os.path.basename(src))[0]
+                failed[src] = f'PDF変換に失敗しました: {base_name}\n{detail}'
+
+    return converted, failed
+
+
+def _group_batches(paths):
+    """出力先ディレクトリとエクスポートフィルタごとにまとめる。同名PDFになるファイルは別バッチに分ける。"""
+    batches = []
+    for src in paths:
+        output_dir = os.path.dirname(src)
+        pdf_path = _pdf_path_for(src)
+        for batch_dir, batch in batches:
+            if (batch_dir == output_dir and _export_filter(batch[0]) == _export_filter(src)
+                    and all(_pdf_path_for(b) != pdf_path for b in batch)):
+                batch.append(src)
+                break
+        else:
+            batches.append((output_dir, [src]))
+    return batches
+
+
+def _pdf_path_for(src):
+    return os.path.splitext(src)[0] + '.pdf'
+
+
+def _require_libreoffice():
     lo_path = _find_libreoffice()
     if not lo_path:
         raise RuntimeError(
             'LibreOfficeが見つかりません。PDF変換にはLibreOfficeが必要です。\n'
             'インストール: sudo apt-get install libreoffice-writer libreoffice-calc fonts-noto-cjk'
         )
+    return lo_path
 
-    # LibreOfficeは同時実行でロックファイル競合するため、
-    # 一時的なユーザープロファイルを使って回避する
-    with tempfile.TemporaryDirectory() as user_profile:
-        # PDF出力オプション: レイアウト保持を優先
-        # writer_pdf_Export でページレイアウトを厳密に保持
-        filter_options = (
-            'writer_pdf_Export:'
-            'UseLosslessCompression=true,'
-            'Quality=100,'
-            'ReduceImageResolution=false,'
-            'EmbedStandardFonts=true'
-        )
 
-        proc = subprocess.run(
+def _run_soffice(lo_path, inputs, output_dir, timeout=120, profile=None, cpu_seconds=CONVERT_CPU_SECONDS):
+    """soffice を一時プロファイルで起動し、inputs を output_dir へPDF変換する。
+
+    inputs は同じエクスポートフィルタ（writer/calc）のファイルに揃えておく。
+    複数ファイルは1プロセスで変換するので、timeout・cpu_seconds はファイル数分を渡す。
+    """
+    # LibreOfficeは同時実行でロックファイル競合するため、
+    # 一時的なユーザープロファイルを使って回避する（雛形があればコピーして初期化を省く）
+    # メモリ・CPU時間を制限し、タイムアウト時は soffice の子孫プロセスごと終了する
+    user_profile = new_profile_dir()
+    try:
+        return run_limited(
             [lo_path, '--headless', '--norestore',
              f'-env:UserInstallation=file://{user_profile}',
-             '--convert-to', 'pdf:writer_pdf_Export',
+             '--convert-to', _convert_to_arg(inputs[0], profile),
              '--outdir', output_dir,
-             filepath],
-            capture_output=True, text=True, timeout=120
+             *inputs],
+            timeout=timeout, cpu_seconds=cpu_seconds
         )
+    finally:
+        shutil.rmtree(user_profile, ignore_errors=True)
 
-    if os.path.exists(pdf_path):
-        return pdf_path
 
-    raise RuntimeError(
-        f'PDF変換に失敗しました: {base_name}\n'
-        f'stdout: {proc.stdout}\nstderr: {proc.stderr}'
-    )
+def get_pool():
+    """プロセスごとの常駐ワーカープールを返す。利用できない場合は None。
+
+    gunicorn の fork 後に親のプールを使わないよう、PIDが変わったら作り直す。
+    プールを有効にしているのに起動できない場合（LibreOffice・pyuno が無い）は、変換のたびに
+    soffice を起動する遅い経路になるため、エラーとしてログに出し pool_status() を 'unavailable' にする。
+    """
+    global _pool, _pool_pid, _pool_status
+    if _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool_pid == os.getpid():
+            return _pool
+        _pool, _pool_pid, _pool_status = None, os.getpid(), 'disabled'
+        if POOL_SIZE <= 0 and not SIDECAR_ENDPOINTS:
+            return None
+        lo_path = _find_libreoffice()
+        if not lo_path:
+            _pool_status = 'unavailable'
+            logger.error('LibreOffice worker pool is configured but LibreOffice was not found; pool disabled')
+            return None
+        uno = import_uno(lo_path)
+        if uno is None:
+            _pool_status = 'unavailable'
+            logger.error(f'LibreOffice worker pool is configured but pyuno cannot be imported by {sys.executable}; '
+                         'pool disabled and every conversion will cold-start soffice. '
+                         'python3-uno must be built for the same Python that runs the app.')
+            return None
+        _pool = OfficePool(lo_path, uno)
+        _pool_status = 'enabled'
+        atexit.register(_pool.close)
+        logger.info(f'LibreOffice worker pool enabled ({_pool.size} workers)')
+        return _pool
+
+
+def pool_status():
+    """このプロセスの常駐プールの状態（'enabled' / 'disabled' / 'unavailable'、初回変換前は 'not_started'）。"""
+    return _pool_status if _pool_pid == os.getpid() else 'not_started'
+
+
+def get_cache():
+    """PDF変換キャッシュを返す。PDF_CACHE_MAX_MB=0 なら無効（None）。"""
+    global _cache
+    if PDF_CACHE_MAX_MB <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PdfCache()
+        return _cache
+
+
+def resolve_profile(profile=None):
+    """プロファイル名を確定する。未知の名前は ValueError。"""
+    profile = profile or PDF_PROFILE
+    if profile not in PDF_PROFILES:
+        raise ValueError(f'未対応のPDFプロファイルです: {profile}')
+    return profile
+
+
+def _should_optimize(profile):
+    if PDF_OPTIMIZE in ('0', '1'):
+        return PDF_OPTIMIZE == '1'
+    return PDF_PROFILES[profile]['optimize']
+
+
+def _postprocess(pdf_path, profile):
+    if not _should_optimize(profile):
+        return
+    from .pdf_optimize import optimize_pdf
+
+    before, after = optimize_pdf(pdf_path)
+    logger.info(f'Optimized {os.path.basename(pdf_path)}: {before} -> {after} bytes')
+
+
+def _convert_to_arg(filepath, profile):
+    """soffice --convert-to の値。FilterData は JSON 形式（LibreOffice 7.4 以降）で渡す。"""
+    filter_data = {name: {'type': 'boolean' if isinstance(value, bool) else 'long',
+                          'value': str(value).lower() if isinstance(value, bool) else str(value)}
+                   for name, value in PDF_PROFILES[resolve_profile(profile)]['filter_data'].items()}
+    return f'pdf:{_export_filter(filepath)}:{json.dumps(filter_data)}'
+
+
+def _cache_key(filepath, profile=None):
+    profile = resolve_profile(profile)
+    return content_hash(filepath, _export_filter(filepath), profile,
+                        json.dumps(PDF_PROFILES[profile]['filter_data'], sort_keys=True),
+                        _should_optimize(profile))
+
+
+def _export_filter(filepath):
+    """拡張子に応じたPDFエクスポートフィルタ名。"""
+    if filepath.lower().endswith('.xlsx'):
+        return 'calc_pdf_Export'
+    return 'writer_pdf_Export'
 
 
 def _find_libreoffice():
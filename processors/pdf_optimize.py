@@ -0,0 +1,58 @@
+"""PDFの後処理 — 重複オブジェクトの統合と線形化（低速回線でのダウンロード・表示向け）
+
+LibreOffice の出力では、同じフォント・画像（印影・ロゴなど）が別オブジェクトとして
+重複して埋め込まれることがある。pypdf で内容が同一のオブジェクトを1つにまとめ、
+参照されなくなったオブジェクトを削除する。
+
+pypdf は線形化（Fast Web View）したPDFを書き出せないため、qpdf が見つかった場合だけ
+続けて線形化する（無ければ重複の統合のみ）。
+"""
+import logging
+import os
+import shutil
+import subprocess
+
+from pypdf import PdfWriter
+
+logger = logging.getLogger(__name__)
+
+QPDF_TIMEOUT = 60
+
+
+def optimize_pdf(path):
+    """path のPDFをその場で最適化する。戻り値は (処理前のバイト数, 処理後のバイト数)。
+
+    失敗した場合は元のPDFをそのまま残す。
+    """
+    before = os.path.getsize(path)
+    deduped = path + '.dedup'
+    linearized = path + '.lin'
+    try:
+        writer = PdfWriter(clone_from=path)
+        writer.compress_identical_objects()
+        with open(deduped, 'wb') as f:
+            writer.write(f)
+        result = deduped
+        qpdf = _find_qpdf()
+        if qpdf:
+            proc = subprocess.run([qpdf, '--linearize', deduped, linearized],
+                                  capture_output=True, text=True, timeout=QPDF_TIMEOUT)
+            # 終了コード 3 は警告のみ（出力は有効）
+            if proc.returncode in (0, 3) and os.path.exists(linearized):
+                result = linearized
+            else:
+                logger.warning(f'qpdf linearization failed for {os.path.basename(path)}: {proc.stderr}')
+        # 線形化すると僅かに大きくなることがあるが、先頭ページを先に表示できるので採用する
+        if result == linearized or os.path.getsize(result) < before:
+            os.replace(result, path)
+    except Exception as e:
+        logger.warning(f'PDF optimization failed for {os.path.basename(path)}: {e}')
+    finally:
+        for tmp in (deduped, linearized):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return before, os.path.getsize(path)
+
+
+def _find_qpdf():
+    return shutil.which('qpdf')
@@ -0,0 +1,86 @@
+"""書類チェックのルール定義 — rules.json を起動時に1本の正規表現へまとめて照合する
+
+ルールは {ルール名: {"keywords": [...], "patterns": [...], "replacement": ..., "within": ...}} で、
+keywords は文字列の部分一致、patterns は正規表現。大会名や様式の文言が変わった場合は
+rules.json（または CHECK_RULES_PATH で指定したファイル）を編集すればよい。
+
+全ルールを1本の選択正規表現にまとめ、段落ごとに1回だけ走査する。
+どれかに一致した段落（ごく一部）だけ、ルールごとに該当パターンを確かめる。
+"within" を持つルールは絞り込み用で、まとめた正規表現には入れず、
+親ルールに一致した段落でだけ照合する（先頭が \d などの高コストなパターン向け）。
+"""
+import hashlib
+import json
+import os
+import re
+
+CHECK_RULES_PATH = os.environ.get(
+    'CHECK_RULES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json'))
+
+
+class RuleSet:
+    """コンパイル済みのルール集合。version はルール定義の内容のハッシュ（処理結果の再利用判定用）。"""
+
+    def __init__(self, rules, version=''):
+        self.rules = rules
+        self.version = version
+        self._compiled = {}
+        self._refinements = {}
+        alternatives = []
+        for name, rule in rules.items():
+            sources = [re.escape(kw) for kw in rule.get('keywords', [])] + list(rule.get('patterns', []))
+            if not sources:
+                raise ValueError(f'ルール {name} に keywords / patterns がありません')
+            self._compiled[name] = [re.compile(src) for src in sources]
+            parent = rule.get('within')
+            if parent:
+                if parent not in rules or rules[parent].get('within'):
+                    raise ValueError(f'ルール {name} の within が不正です: {parent}')
+                self._refinements[name] = parent
+            else:
+                alternatives.extend(f'(?:{src})' for src in sources)
+        self._combined = re.compile('|'.join(alternatives))
+
+    @property
+    def names(self):
+        return list(self.rules)
+
+    def scan(self, text):
+        """text に一致したルールを {ルール名: 一致したパターン番号のリスト} で返す。"""
+        if not self._combined.search(text):
+            return {}
+        hits = {}
+        for name, compiled in self._compiled.items():
+            if name in self._refinements:
+                continue
+            matched = [i for i, rx in enumerate(compiled) if rx.search(text)]
+            if matched:
+                hits[name] = matched
+        for name, parent in self._refinements.items():
+            if parent in hits:
+                matched = [i for i, rx in enumerate(self._compiled[name]) if rx.search(text)]
+                if matched:
+                    hits[name] = matched
+        return hits
+
+    def source(self, name, i):
+        """パターン番号 i の元の文字列（keywords → patterns の順）。"""
+        rule = self.rules[name]
+        return (list(rule.get('keywords', [])) + list(rule.get('patterns', [])))[i]
+
+    def sub(self, name, text):
+        """ルール name のパターンを順に replacement へ置換する。"""
+        replacement = self.rules[name]['replacement']
+        for rx in self._compiled[name]:
+            if rx.search(text):
+                text = rx.sub(lambda m: replacement, text)
+        return text
+
+
+def load_rules(path=CHECK_RULES_PATH):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return RuleSet(json.loads(data.decode('utf-8')), hashlib.sha256(data).hexdigest())
+
+
+RULES = load_rules()
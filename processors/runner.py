@@ -0,0 +1,154 @@
+"""変換プロセスの実行 — 資源制限・プロセスグループ単位の強制終了・資源使用量の記録
+
+subprocess.run(timeout=...) は経過時間しか制限せず、タイムアウト時も直接の子（soffice の
+ラッパー）しか終了しないため、soffice.bin などの孫プロセスが残ってメモリを使い続けることがある。
+ここでは soffice を独自のプロセスグループで起動してメモリ（アドレス空間）と CPU 時間を rlimit で制限し、
+タイムアウト時と終了後にグループごと強制終了する。終了時の資源使用量（CPU 時間・ピークRSS）は
+ログと /metrics（contract_prepper_conversion_*）に記録し、上限値の調整に使う。
+
+プロセスグループ・資源使用量は POSIX のみ、rlimit は prlimit のある Linux のみ。
+Windows では taskkill /T でプロセスツリーを終了し、経過時間だけを記録する。
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .metrics import observe_conversion
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# 変換プロセスのアドレス空間の上限（MB、0 で無制限）。soffice は実際の使用量より大きく
+# 仮想メモリを確保するので、通常の変換で使う量より十分大きくしておく
+CONVERT_MEMORY_MB = int(os.environ.get('CONVERT_MEMORY_MB', '3072'))
+# 変換プロセスの CPU 時間の上限（秒、0 で無制限）。超えると SIGXCPU で終了する
+CONVERT_CPU_SECONDS = int(os.environ.get('CONVERT_CPU_SECONDS', '120'))
+CPU_KILL_GRACE = 5
+
+
+def popen_limited(cmd, memory_mb=CONVERT_MEMORY_MB, cpu_seconds=CONVERT_CPU_SECONDS, **kwargs):
+    """cmd を独自のプロセスグループで起動し、rlimit を掛ける。kwargs は Popen にそのまま渡す。
+
+    preexec_fn はスレッドを持つ親プロセス（ジョブ・変換スレッド）では安全でないため使わず、
+    起動直後に prlimit で子プロセスへ設定する。rlimit は設定後に作られた孫プロセスにだけ引き継がれるが、
+    Popen は exec の完了を待って戻るので、通常は soffice が soffice.bin を起動するより先に設定できる。
+    prlimit の無い環境（Linux 以外）では制限しない。
+    """
+    if os.name == 'nt':
+        return subprocess.Popen(cmd, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP, **kwargs)
+    proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+    if resource is None or not hasattr(resource, 'prlimit'):
+        return proc
+    try:
+        if memory_mb > 0:
+            resource.prlimit(proc.pid, resource.RLIMIT_AS, (memory_mb * 1024 * 1024,) * 2)
+        if cpu_seconds > 0:
+            # ソフト上限で SIGXCPU、応じなければハード上限で SIGKILL
+            resource.prlimit(proc.pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + CPU_KILL_GRACE))
+    except ProcessLookupError:
+        # 既に終了している
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not set resource limits on pid {proc.pid}: {e}")
+    return proc
+
+
+def kill_tree(proc):
+    """proc とその子孫（同じプロセスグループ）を強制終了する。既に終了していれば何もしない。"""
+    if os.name == 'nt':
+        # 終了済みの PID は再利用されている可能性があるので触らない
+        if proc.poll() is None:
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)], capture_output=True)
+        return
+    try:
+        # start_new_session で起動しているので、プロセスグループIDは proc.pid
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_limited(cmd, timeout, memory_mb=CONVERT_MEMORY_MB, cpu_seconds=CONVERT_CPU_SECONDS):
+    """cmd を資源制限付きで実行し、終了を待つ。subprocess.run と同じく CompletedProcess を返す。
+
+    戻り値の usage 属性に資源使用量（wall_seconds・cpu_seconds・peak_rss_mb・outcome）を持つ。
+    タイムアウトしたらプロセスグループごと強制終了して subprocess.TimeoutExpired を送出する。
+    """
+    started = time.perf_counter()
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        proc = popen_limited(cmd, memory_mb, cpu_seconds, stdout=out, stderr=err)
+        reaper = _Reaper(proc)
+        timed_out = not reaper.wait(timeout)
+        if timed_out:
+            kill_tree(proc)
+            reaper.wait(None)
+        # 正常終了でも、親より後まで残った子孫プロセスを片付ける
+        kill_tree(proc)
+        stdout, stderr = _read(out), _read(err)
+
+    usage = _usage(proc.returncode, reaper.rusage, time.perf_counter() - started, timed_out)
+    observe_conversion(usage)
+    logger.info(f"Conversion process {usage['outcome']}: wall {usage['wall_seconds']}s, "
+                f"cpu {usage['cpu_seconds']}s, peak RSS {usage['peak_rss_mb']} MB")
+    if timed_out:
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+    completed = subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+    completed.usage = usage
+    return completed
+
+
+class _Reaper:
+    """子プロセスの終了を別スレッドで待つ。POSIX では os.wait4 で資源使用量も受け取る。
+
+    wait4 の資源使用量には、子が待ち受けた（終了を回収した）孫プロセスの分も含まれる。
+    """
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.rusage = None
+        self._thread = threading.Thread(target=self._reap, daemon=True)
+        self._thread.start()
+
+    def _reap(self):
+        if not hasattr(os, 'wait4'):
+            self.proc.wait()
+            return
+        _, status, self.rusage = os.wait4(self.proc.pid, 0)
+        # 回収済みであることを Popen に知らせる（再度 waitpid させない）
+        self.proc.returncode = os.waitstatus_to_exitcode(status)
+
+    def wait(self, timeout):
+        """終了したら True。timeout 秒経っても終了しなければ False。"""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def _usage(returncode, rusage, wall_seconds, timed_out):
+    if timed_out:
+        outcome = 'timeout'
+    elif returncode == 0:
+        outcome = 'ok'
+    elif hasattr(signal, 'SIGXCPU') and returncode == -signal.SIGXCPU:
+        outcome = 'cpu_limit'
+    else:
+        outcome = 'failed'
+    usage = {'outcome': outcome, 'returncode': returncode, 'wall_seconds': round(wall_seconds, 3),
+             'cpu_seconds': None, 'peak_rss_mb': None}
+    if rusage is not None:
+        usage['cpu_seconds'] = round(rusage.ru_utime + rusage.ru_stime, 3)
+        # Linux は KB、macOS はバイト単位
+        usage['peak_rss_mb'] = round(rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    return usage
+
+
+def _read(f):
+    f.seek(0)
+    return f.read().decode(errors='replace')
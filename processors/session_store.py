@@ -0,0 +1,160 @@
+"""差分再処理用のセッションストア — 書類枠ごとの入力・オプション・成果物を保持する
+
+利用者は1通だけ直して5通とも再提出することが多い。そこでセッションIDごと・書類枠（contract など）
+ごとに、入力内容と処理オプションのハッシュ（fingerprint）、処理結果（メッセージ・法人情報）、
+PDF変換後の成果物を保存しておき、fingerprint が前回と同じ枠は整形・PDF変換を省いて再利用する。
+
+保存先は SESSION_STORE_DIR/<セッションID>/<書類キー>/。最終利用から SESSION_TTL 秒で期限切れとし、
+合計が SESSION_STORE_MAX_MB を超えたら最終利用が古いセッションから削除する。
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from .common import link_or_copy
+from .pdf_cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE_DIR = os.environ.get(
+    'SESSION_STORE_DIR', os.path.join(tempfile.gettempdir(), 'contract_prepper_sessions'))
+SESSION_STORE_MAX_MB = int(os.environ.get('SESSION_STORE_MAX_MB', '200'))
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '3600'))
+
+META_NAME = 'slot.json'
+# 再利用する処理結果の項目（timings は毎回の計測なので保存しない）
+RESULT_FIELDS = ('output_name', 'errors', 'warnings', 'entity_info')
+
+_SESSION_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id):
+    """クライアントから受け取ったセッションIDが妥当か（保存先のパスに使うため形式を限定する）。"""
+    return bool(session_id) and _SESSION_ID_RE.fullmatch(session_id) is not None
+
+
+def slot_fingerprint(filepath, key, options):
+    """書類枠の入力内容（ZIPの保存日時などを除く）と処理オプションのハッシュ。"""
+    return content_hash(filepath, key, *(f'{name}={options[name]}' for name in sorted(options)))
+
+
+class SessionStore:
+    """TTL と容量上限付きのディスクストア。"""
+
+    def __init__(self, directory=SESSION_STORE_DIR, max_bytes=SESSION_STORE_MAX_MB * 1024 * 1024,
+                 ttl=SESSION_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _slot_dir(self, session_id, key):
+        return os.path.join(self.directory, session_id, key)
+
+    def restore(self, session_id, key, fingerprint, output_dir):
+        """fingerprint が一致すれば成果物を output_dir に置き、保存済みの処理結果を返す。無ければ None。"""
+        slot = self._slot_dir(session_id, key)
+        meta_path = os.path.join(slot, META_NAME)
+        placed = []
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.ttl:
+                return None
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['fingerprint'] != fingerprint:
+                return None
+            for name in meta['files']:
+                dst = os.path.join(output_dir, name)
+                link_or_copy(os.path.join(slot, name), dst)
+                placed.append(dst)
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError):
+            for path in placed:
+                os.remove(path)
+            return None
+        return meta['result']
+
+    def save(self, session_id, key, fingerprint, result, paths):
+        """処理結果と成果物（paths）を保存する。保存に失敗しても処理自体は続ける。"""
+        session_dir = os.path.join(self.directory, session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=f'.{key}_', dir=session_dir)
+        try:
+            for path in paths:
+                link_or_copy(path, os.path.join(staging, os.path.basename(path)))
+            meta = {'fingerprint': fingerprint,
+                    'result': {field: result[field] for field in RESULT_FIELDS if field in result},
+                    'files': [os.path.basename(path) for path in paths]}
+            with open(os.path.join(staging, META_NAME), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            slot = self._slot_dir(session_id, key)
+            with self._lock:
+                shutil.rmtree(slot, ignore_errors=True)
+                os.replace(staging, slot)
+        except OSError as e:
+            logger.warning(f'Session store save failed: {e}')
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self._evict()
+
+    def _evict(self):
+        """期限切れのセッションを削除し、上限を超えた分を最終利用が古い順に削除する。"""
+        now = time.time()
+        with self._lock:
+            sessions = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.is_dir():
+                    continue
+                last_used, size = _session_stats(entry.path)
+                if now - last_used > self.ttl:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                sessions.append((last_used, size, entry.path))
+                total += size
+            sessions.sort()
+            while total > self.max_bytes and sessions:
+                _, size, path = sessions.pop(0)
+                total -= size
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def _session_stats(session_dir):
+    """(最終利用時刻, 合計バイト数)。最終利用は各書類枠の slot.json の更新日時の最大値。"""
+    last_used = 0.0
+    size = 0
+    for root, _, files in os.walk(session_dir):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            if name == META_NAME:
+                last_used = max(last_used, st.st_mtime)
+    return last_used or os.path.getmtime(session_dir), size
+
+
+def get_session_store():
+    """セッションストアを返す。SESSION_STORE_MAX_MB=0 なら無効（None）。"""
+    global _store
+    if SESSION_STORE_MAX_MB <= 0:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
@@ -0,0 +1,97 @@
+"""チェックのみの高速パス（/validate 用）
+
+整形・保存・PDF変換は行わず、本文テキストを流し読みして
+契約書・誓約書のチェック、エンティティ抽出（Excel・PDFを含む）、書類間の突合だけを行う。
+"""
+import os
+import zipfile
+
+from lxml import etree
+
+from .common import ParagraphIndex, extract_entity_info_from_text, cross_check_entities
+from .contract import (_check_date_fields, _check_seal_clause_exists, _check_appendix2_version,
+                       _partner_section)
+from .extractors import extract_entity_info_from_pdf, extract_entity_info_from_xlsx
+from .fast_reader import read_docx_paragraphs
+from .metrics import timed, file_format
+from .oath import _check_signature, _find_old_title
+from .rules import RULES
+
+DOC_LABELS = {
+    'contract': '契約書',
+    'estimate': '見積書',
+    'oath': '誓約書',
+    'checklist': 'チェックシート',
+    'confirmation': '確認書',
+}
+
+
+def validate_document(key, source, filename, approval_type):
+    """1書類をチェックする。source はパスまたはファイルオブジェクト。
+
+    戻り値は {'errors': [...], 'warnings': [...], 'entity_info': dict | None}。
+    """
+    result = {'errors': [], 'warnings': [], 'entity_info': None}
+    ext = os.path.splitext(filename)[1].lower()
+    label = DOC_LABELS[key]
+
+    if ext == '.pdf':
+        result['entity_info'] = extract_entity_info_from_pdf(source)
+        return result
+    if ext == '.xlsx':
+        result['entity_info'] = extract_entity_info_from_xlsx(source)
+        return result
+    if ext not in ('.docx', '.doc'):
+        result['errors'].append(f'{label}: 未対応のファイル形式です ({ext})')
+        return result
+
+    try:
+        texts = read_docx_paragraphs(source)
+    except (zipfile.BadZipFile, KeyError, ValueError, etree.XMLSyntaxError):
+        # ZIPでない・本文パーツが無い・XMLが壊れている
+        result['errors'].append(f'{label}: Word文書として読み込めません ({filename})')
+        return result
+
+    if key == 'contract':
+        index = ParagraphIndex.from_texts(texts, RULES)
+        if approval_type == 'paper':
+            _check_date_fields(index, result)
+            _check_seal_clause_exists(index, result)
+        _check_appendix2_version(index, result)
+        # /process と同じく、削除される段落（パートナーのセクション・電子決裁の署名捺印条項）は
+        # エンティティ抽出に使わない
+        excluded = set(_partner_section(index))
+        if approval_type == 'electronic':
+            excluded.update(index.positions('seal'))
+        texts = [t for i, t in enumerate(texts) if i not in excluded]
+    elif key == 'oath':
+        old_title = _find_old_title(texts)
+        if old_title is not None:
+            result['warnings'].append(
+                f'誓約書の件名が旧名称です（処理時に正式名称へ修正されます）: 「{old_title.strip()[:30]}...」'
+            )
+        _check_signature('\n'.join(texts), result)
+
+    result['entity_info'] = extract_entity_info_from_text('\n'.join(texts))
+    return result
+
+
+def validate_package(documents, approval_type):
+    """書類一式をチェックする。documents は {書類キー: (ソース, 元ファイル名)}。"""
+    results = {'errors': [], 'warnings': [], 'timings': []}
+    entity_infos = {}
+    for key in DOC_LABELS:
+        if key not in documents:
+            continue
+        source, filename = documents[key]
+        with timed(results['timings'], 'validate', key, file_format(filename)):
+            res = validate_document(key, source, filename, approval_type)
+        results['errors'].extend(res['errors'])
+        results['warnings'].extend(res['warnings'])
+        if res['entity_info']:
+            entity_infos[key] = res['entity_info']
+
+    if len(entity_infos) > 1:
+        with timed(results['timings'], 'cross_check'):
+            results['errors'].extend(cross_check_entities(entity_infos))
+    return results
@@ -61,32 +61,44 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // Retry fetch with exponential backoff
-    async function fetchWithRetry(url, options, maxRetries = 3) {
-        let lastError;
-        for (let i = 0; i < maxRetries; i++) {
+    const sleep = ms => new Promise(r => setTimeout(r, ms));
+
+    // Fetch that follows the server's admission control: on 429/503 wait for the
+    // Retry-After it sends (showing the queue position) and try again. Only network
+    // failures, where the server gave no guidance, fall back to a short fixed retry.
+    async function fetchWithBackpressure(url, options, maxWaitSeconds = 600, networkRetries = 3) {
+        let waited = 0;
+        let failures = 0;
+        while (true) {
+            let resp;
             try {
-                console.log(`Fetch attempt ${i + 1} to ${url}...`);
-                const resp = await fetch(url, options);
-                console.log(`Fetch response: ${resp.status}`);
-                return resp;
+                resp = await fetch(url, options);
             } catch (e) {
-                lastError = e;
-                console.error(`Attempt ${i + 1} failed:`, e.name, e.message);
-                if (i < maxRetries - 1) {
-                    // Wait before retry (2s, 4s, 8s)
-                    const waitTime = 2000 * Math.pow(2, i);
-                    console.log(`Waiting ${waitTime}ms before retry...`);
-                    await new Promise(r => setTimeout(r, waitTime));
-                }
+                console.error(`Fetch to ${url} failed:`, e.name, e.message);
+                if (++failures > networkRetries) throw e;
+                await sleep(2000);
+                continue;
+            }
+            if ((resp.status === 429 || resp.status === 503) && waited < maxWaitSeconds) {
+                const data = await resp.json().catch(() => ({}));
+                const retryAfter = parseInt(resp.headers.get('Retry-After'), 10) || data.retry_after || 5;
+                if (spinnerText) spinnerText.textContent = describeQueue(data.queue_position, retryAfter);
+                console.log(`Server busy (${resp.status}), retrying in ${retryAfter}s`);
+                await sleep(retryAfter * 1000);
+                waited += retryAfter;
+                continue;
             }
+            return resp;
         }
-        throw lastError;
     }
 
+    // 同じセッションIDで再提出すると、変更の無い書類はサーバー側で前回の成果物が再利用される
+    let sessionId = sessionStorage.getItem('contractPrepperSession');
+
     form.addEventListener('submit', async e => {
         e.preventDefault();
         const formData = new FormData(form);
+        if (sessionId) formData.set('session_id', sessionId);
 
         // Basic client-side validation
         if (!formData.get('company_name').trim()) {
@@ -121,9 +133,39 @@ document.addEventListener('DOMContentLoaded', () => {
             if (spinnerText) spinnerText.textContent = 'ファイルを処理中...（PDF変換に時間がかかる場合があります）';
             console.log('Server awake, sending files for processing...');
 
-            const resp = await fetchWithRetry('/process', { method: 'POST', body: formData });
+            const created = await fetchWithBackpressure('/jobs', { method: 'POST', body: formData });
+            if (!created.ok) {
+                const data = await created.json();
+                throw new Error(data.error || '処理に失敗しました。');
+            }
+            const job = await created.json();
+            if (job.session_id) {
+                sessionId = job.session_id;
+                sessionStorage.setItem('contractPrepperSession', sessionId);
+            }
+
+            // Step 3: Poll job status until processing and PDF conversion finish
+            let status;
+            while (true) {
+                await sleep(1500);
+                const statusResp = await fetchWithBackpressure(job.status_url, { cache: 'no-store' });
+                status = await statusResp.json();
+                if (!statusResp.ok) throw new Error(status.error || '処理状況を取得できませんでした。');
+                if (status.status === 'done' || status.status === 'failed') break;
+                if (spinnerText) {
+                    spinnerText.textContent = status.status === 'queued' && status.queue_position
+                        ? describeQueue(status.queue_position, status.retry_after)
+                        : '処理中... ' + describeProgress(status.documents);
+                }
+            }
+            if (status.status === 'failed') {
+                throw new Error(status.error || '処理に失敗しました。');
+            }
+
+            const resp = await fetchWithBackpressure(job.result_url, { cache: 'no-store' });
 
             if (resp.ok) {
+                const bundled = formData.get('output_mode') === 'pdf';
                 if (spinnerText) spinnerText.textContent = 'ダウンロード準備中...';
                 const blob = await resp.blob();
                 const url = URL.createObjectURL(blob);
@@ -131,12 +173,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 a.href = url;
                 a.download = resp.headers.get('content-disposition')
                     ?.match(/filename\*?=(?:UTF-8'')?(.+)/)?.[1]
-                    || '契約書処理結果.zip';
+                    || (bundled ? '契約書処理結果.pdf' : '契約書処理結果.zip');
                 document.body.appendChild(a);
                 a.click();
                 a.remove();
                 URL.revokeObjectURL(url);
-                showResult('success', ['処理が完了しました。ZIPファイルをダウンロードしています。']);
+                showResult('success', [`処理が完了しました。${bundled ? '結合PDF' : 'ZIPファイル'}をダウンロードしています。`]);
             } else {
                 const data = await resp.json();
                 showResult('error', [data.error || '処理に失敗しました。']);
@@ -154,6 +196,19 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    const STATE_LABELS = { pending: '待機中', processed: '整形済', converted: 'PDF化済', failed: '失敗', skipped: '対象外' };
+
+    function describeProgress(documents) {
+        return Object.values(documents || {})
+            .map(d => `${d.label}: ${STATE_LABELS[d.state] || d.state}`)
+            .join(' / ');
+    }
+
+    function describeQueue(position, seconds) {
+        const where = position ? `順番待ち ${position} 番目` : '混雑中';
+        return seconds ? `${where}（開始まで約${seconds}秒）...` : `${where}...`;
+    }
+
     function showResult(type, messages) {
         resultArea.style.display = 'block';
         const alert = document.getElementById('resultAlert');
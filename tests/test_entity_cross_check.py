@@ -0,0 +1,107 @@
+"""Excel・PDF から抽出した法人情報と docx の突合（表記ゆれで誤ってエラーにしないこと）"""
+import os
+import sys
+
+from docx import Document
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from processors.common import cross_check_entities, extract_entity_info_from_text
+from processors.extractors import extract_entity_info_from_pdf, extract_entity_info_from_xlsx
+
+COMPANY = '株式会社テスト'
+ADDRESS = '愛知県名古屋市中区三の丸1-1-1'
+REPRESENTATIVE = '山田太郎'
+
+
+def _docx_info(tmp_path):
+    path = tmp_path / 'contract.docx'
+    doc = Document()
+    for line in (f'乙：{COMPANY}', f'住所：{ADDRESS}', f'代表取締役 {REPRESENTATIVE}'):
+        doc.add_paragraph(line)
+    doc.save(path)
+    return extract_entity_info_from_text('\n'.join(p.text for p in Document(path).paragraphs))
+
+
+def _write_xlsx(path):
+    """ラベルと値が別セルで、同じ行に他のセル（金額・備考）もある見積書。"""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['御見積書'])
+    ws.append(['乙：', COMPANY, None, '見積金額', 1200000])
+    ws.append(['住所：', '愛知県名古屋市中区三の丸１－１－１', '備考', '税込'])
+    ws.append(['代表取締役', REPRESENTATIVE, '印'])
+    wb.save(path)
+
+
+def _write_pdf(path, lines):
+    """lines を1行ずつ描いたPDFを作る。文字コード→Unicode は ToUnicode CMap で与える。"""
+    chars = sorted({c for line in lines for c in line})
+    codes = {c: i + 1 for i, c in enumerate(chars)}
+    cmap = '\n'.join([
+        '/CIDInit /ProcSet findresource begin 12 dict begin begincmap',
+        '/CMapName /Test def 1 begincodespacerange <00> <FF> endcodespacerange',
+        f'{len(chars)} beginbfchar',
+        *(f'<{codes[c]:02X}> <{ord(c):04X}>' for c in chars),
+        'endbfchar endcmap CMapName currentdict /CMap defineresource pop end end',
+    ]).encode()
+    content = ['BT /F1 12 Tf 14 TL 50 750 Td']
+    for line in lines:
+        content.append('<' + ''.join(f'{codes[c]:02X}' for c in line) + "> Tj T*")
+    content.append('ET')
+    content = '\n'.join(content).encode()
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /ToUnicode 6 0 R >>',
+        b'<< /Length %d >>\nstream\n' % len(cmap) + cmap + b'\nendstream',
+    ]
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % i + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def test_xlsx_takes_value_from_adjacent_cell(tmp_path):
+    path = tmp_path / 'estimate.xlsx'
+    _write_xlsx(path)
+    info = extract_entity_info_from_xlsx(path)
+    assert info['company'] == COMPANY
+    assert info['representative'] == REPRESENTATIVE
+
+
+def test_matching_xlsx_and_pdf_do_not_raise_errors(tmp_path):
+    xlsx = tmp_path / 'estimate.xlsx'
+    _write_xlsx(xlsx)
+    pdf = tmp_path / 'checklist.pdf'
+    # PDFのテキストは文字間に空白が入ったり全角になったりする
+    _write_pdf(pdf, ['乙： 株式会社 テスト', '住所：愛知県名古屋市中区 三の丸１-１-１', '代表取締役 山田 太郎'])
+
+    infos = {
+        'contract': _docx_info(tmp_path),
+        'estimate': extract_entity_info_from_xlsx(xlsx),
+        'checklist': extract_entity_info_from_pdf(pdf),
+    }
+    assert all(info['company'] for info in infos.values())
+    assert cross_check_entities(infos) == []
+
+
+def test_different_values_are_still_reported(tmp_path):
+    pdf = tmp_path / 'checklist.pdf'
+    _write_pdf(pdf, ['乙：株式会社ベツ', '代表取締役 山田 太郎'])
+    errors = cross_check_entities({
+        'contract': _docx_info(tmp_path),
+        'checklist': extract_entity_info_from_pdf(pdf),
+    })
+    assert len(errors) == 1
+    assert '法人名' in errors[0]
@@ -0,0 +1,146 @@
+"""起動の高速化 — 重いモジュールの先読みと LibreOffice の暖機
+
+app.py は python-docx・openpyxl・pypdf などを読み込まずに待ち受けを始め、/health と / は
+すぐに返す。重いモジュールは start() が起こすバックグラウンドスレッドで読み込み、
+続けて LibreOffice のユーザープロファイルの雛形を用意してダミー文書を1回PDF変換する
+（実行ファイル・フォントのディスク読み込みと、常駐ワーカープールの起動を済ませておく）。
+
+イメージのビルド時に `python warmup.py` を実行すると、雛形（LO_PROFILE_TEMPLATE）を
+イメージに焼き込める。起動からの各時点（最初の応答・モジュール読み込み完了・最初のPDF）は
+processors.metrics.mark_startup() で記録し、/health と /metrics で返す。
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from processors.metrics import mark_startup
+from processors.office_pool import PROFILE_TEMPLATE, STARTUP_TIMEOUT, profile_template_ready
+from processors.runner import run_limited
+
+logger = logging.getLogger(__name__)
+
+# 先読みするモジュール（書類処理・一括処理・チェックのみ）
+WARMUP_MODULES = ('processors.package', 'processors.batch', 'processors.validation')
+# 起動時に LibreOffice を暖機するか（0 で無効。モジュールの先読みは常に行う）
+WARMUP_LIBREOFFICE = os.environ.get('WARMUP_LIBREOFFICE', '1') != '0'
+
+_modules_ready = threading.Event()
+
+
+def start():
+    """先読みと暖機をバックグラウンドで始める。spawn された子プロセスでは何もしない。"""
+    if multiprocessing.parent_process() is not None:
+        return
+    threading.Thread(target=_warm, name='warmup', daemon=True).start()
+
+
+def modules_ready():
+    return _modules_ready.is_set()
+
+
+def _warm():
+    try:
+        preload_modules()
+    except Exception as e:
+        logger.warning(f'Module preload failed: {e}')
+        return
+    if WARMUP_LIBREOFFICE:
+        try:
+            warm_libreoffice()
+        except Exception as e:
+            logger.warning(f'LibreOffice warm-up failed: {e}')
+
+
+def preload_modules():
+    for name in WARMUP_MODULES:
+        importlib.import_module(name)
+    _modules_ready.set()
+    mark_startup('modules_loaded')
+
+
+def warm_libreoffice():
+    """雛形を用意し、通常の変換経路（常駐プール → 都度起動）でダミー文書を1回変換する。
+
+    LibreOffice が無ければ何もせず False を返す。
+    """
+    from processors.pdf_converter import _convert_uncached, _find_libreoffice, _pdf_path_for
+
+    lo_path = _find_libreoffice()
+    if not lo_path:
+        logger.info('LibreOffice not found; skipping warm-up')
+        return False
+    build_profile_template(lo_path)
+    with tempfile.TemporaryDirectory() as work_dir:
+        src = write_dummy_document(work_dir)
+        # キャッシュを通すと2回目以降の起動で LibreOffice が動かないため直接変換する
+        _convert_uncached(src, _pdf_path_for(src))
+    mark_startup('first_pdf')
+    return True
+
+
+def build_profile_template(lo_path, template_dir=PROFILE_TEMPLATE):
+    """雛形が無ければ、新しいプロファイルでダミー文書を変換して作る。作ったら True。
+
+    複数の gunicorn ワーカーが同時に作っても壊れないよう、別ディレクトリで作ってから改名する。
+    """
+    if profile_template_ready():
+        return False
+    parent = os.path.dirname(os.path.abspath(template_dir))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='lo_profile_template_', dir=parent)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            src = write_dummy_document(work_dir)
+            proc = run_limited(
+                [lo_path, '--headless', '--norestore',
+                 f'-env:UserInstallation={pathlib.Path(staging).as_uri()}',
+                 '--convert-to', 'pdf:writer_pdf_Export', '--outdir', work_dir, src],
+                timeout=STARTUP_TIMEOUT * 2,
+            )
+        if not os.path.isdir(os.path.join(staging, 'user')):
+            raise RuntimeError(f'LibreOfficeのプロファイルを作成できませんでした\nstderr: {proc.stderr}')
+        try:
+            os.replace(staging, template_dir)
+        except OSError:
+            # 他のワーカーが先に作った
+            return False
+        logger.info(f'LibreOffice profile template created: {template_dir}')
+        return True
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def write_dummy_document(directory):
+    """暖機用の小さな docx（日本語フォントも読み込ませる）を作る。"""
+    from docx import Document
+
+    doc = Document()
+    doc.add_paragraph('基本契約書　暖機用')
+    path = os.path.join(directory, 'warmup.docx')
+    doc.save(path)
+    return path
+
+
+if __name__ == '__main__':
+    # イメージのビルド時用: 雛形を作り、ダミー変換にかかった時間を表示する
+    logging.basicConfig(level=logging.INFO)
+    from processors.pdf_converter import _find_libreoffice
+
+    lo_path = _find_libreoffice()
+    if not lo_path:
+        print('LibreOffice not found', file=sys.stderr)
+        sys.exit(1)
+    started = time.perf_counter()
+    created = build_profile_template(lo_path)
+    print(f'profile template: {PROFILE_TEMPLATE} ({"created" if created else "exists"}, '
+          f'{time.perf_counter() - started:.2f}s)')
+    started = time.perf_counter()
+    warm_libreoffice()
+    print(f'dummy conversion with template: {time.perf_counter() - started:.2f}s')